@@ -0,0 +1,140 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ---------------------------
+# Compositing engine for video-on-marker overlays.
+#
+# Only the quad's bounding rectangle is warped and blended, straight into the
+# camera frame (no full-frame warp, mask or 3-channel merge), using scratch
+# buffers that are reused between frames. Video frames larger than the quad
+# are downscaled once and cached, so a frame that's shown several times (video
+# fps below camera fps, or paused) isn't resized again.
+# ---------------------------
+
+
+def quad_from_homography(H, width, height):
+    """Project the corners of a width x height marker into the frame (4x2 float32)."""
+    corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]]).reshape(-1, 1, 2)
+    return cv2.perspectiveTransform(corners, H).reshape(4, 2)
+
+
+class Compositor:
+    """Warps video frames onto marker quads inside a camera frame.
+
+    One instance per render loop; it isn't thread-safe because the scratch
+    buffers are shared between calls.
+    """
+
+    def __init__(self, resize_cache_size=8, interpolation=cv2.INTER_LINEAR):
+        self.interpolation = interpolation
+        self.resize_cache_size = resize_cache_size
+        self._resized = OrderedDict()
+        self._warp_buffer = None
+        self._mask_buffer = None
+        self._where_buffer = None
+
+    # ---------------------------
+    # Scratch buffers: grown when needed, handed out as views
+    # ---------------------------
+    def _buffers(self, width, height, channels, dtype):
+        buffer = self._warp_buffer
+        if (
+            buffer is None or buffer.shape[0] < height or buffer.shape[1] < width
+            or buffer.shape[2:] != (channels,) or buffer.dtype != dtype
+        ):
+            rows = max(height, buffer.shape[0] if buffer is not None else 0)
+            cols = max(width, buffer.shape[1] if buffer is not None else 0)
+            self._warp_buffer = np.empty((rows, cols, channels), dtype=dtype)
+            self._mask_buffer = np.empty((rows, cols), dtype=np.uint8)
+            self._where_buffer = np.empty((rows, cols, 1), dtype=bool)
+        return (
+            self._warp_buffer[:height, :width],
+            self._mask_buffer[:height, :width],
+            self._where_buffer[:height, :width],
+        )
+
+    # ---------------------------
+    # Resize cache
+    # ---------------------------
+    def prepare(self, video_frame, max_size, key=None):
+        """Downscale video_frame to fit max_size (w, h), reusing cached results.
+
+        key identifies the frame's content (e.g. (ad_id, frame_number)); None
+        disables caching. Frames that already fit are returned unchanged.
+        """
+        src_h, src_w = video_frame.shape[:2]
+        scale = min(max_size[0] / src_w, max_size[1] / src_h)
+        if scale >= 1:
+            return video_frame
+        # Round up to a 32px grid so small quad jitter still hits the cache
+        size = (
+            min(src_w, -(-int(src_w * scale) // 32) * 32),
+            min(src_h, -(-int(src_h * scale) // 32) * 32),
+        )
+        if key is not None:
+            cache_key = (key, size)
+            cached = self._resized.get(cache_key)
+            if cached is not None:
+                self._resized.move_to_end(cache_key)
+                return cached
+
+        resized = cv2.resize(video_frame, size, interpolation=cv2.INTER_AREA)
+        if key is not None:
+            self._resized[cache_key] = resized
+            while len(self._resized) > self.resize_cache_size:
+                self._resized.popitem(last=False)
+        return resized
+
+    def clear_cache(self):
+        self._resized.clear()
+
+    # ---------------------------
+    # Compositing
+    # ---------------------------
+    def composite(self, frame, video_frame, quad, key=None):
+        """Draw video_frame into frame over quad (4 corners TL, TR, BR, BL).
+
+        frame is modified in place and returned. key enables the resize cache
+        (see prepare).
+        """
+        quad = np.asarray(quad, dtype=np.float32).reshape(4, 2)
+        frame_h, frame_w = frame.shape[:2]
+
+        # Bounding rectangle of the quad, clipped to the frame
+        x0 = max(int(np.floor(quad[:, 0].min())), 0)
+        y0 = max(int(np.floor(quad[:, 1].min())), 0)
+        x1 = min(int(np.ceil(quad[:, 0].max())) + 1, frame_w)
+        y1 = min(int(np.ceil(quad[:, 1].max())) + 1, frame_h)
+        if x1 <= x0 or y1 <= y0:
+            return frame
+        roi_w, roi_h = x1 - x0, y1 - y0
+
+        source = self.prepare(video_frame, (roi_w, roi_h), key)
+        src_h, src_w = source.shape[:2]
+        if source.ndim != frame.ndim:
+            source = cv2.cvtColor(source, cv2.COLOR_GRAY2BGR if frame.ndim == 3 else cv2.COLOR_BGR2GRAY)
+
+        # Warp into ROI coordinates instead of full-frame coordinates
+        local_quad = quad - np.float32([x0, y0])
+        M = cv2.getPerspectiveTransform(
+            np.float32([[0, 0], [src_w, 0], [src_w, src_h], [0, src_h]]), local_quad
+        )
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        warped, mask, where = self._buffers(roi_w, roi_h, channels, frame.dtype)
+        if frame.ndim == 2:
+            warped, where = warped[:, :, 0], where[:, :, 0]
+        warped = cv2.warpPerspective(source, M, (roi_w, roi_h), dst=warped, flags=self.interpolation)
+
+        mask[:] = 0
+        cv2.fillConvexPoly(mask, np.round(local_quad).astype(np.int32), 255)
+        np.not_equal(mask.reshape(where.shape), 0, out=where)
+
+        # Copy the warped pixels under the mask straight into the frame's ROI view
+        np.copyto(frame[y0:y1, x0:x1], warped, where=where)
+        return frame
+
+    def composite_homography(self, frame, video_frame, H, marker_size, key=None):
+        """composite() with the quad given as a marker-to-frame homography."""
+        return self.composite(frame, video_frame, quad_from_homography(H, *marker_size), key)
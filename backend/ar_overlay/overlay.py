@@ -2,6 +2,18 @@ import cv2
 import numpy as np
 import requests
 import os
+import sys
+
+try:
+    from ar_overlay.compositor import Compositor
+    from ar_overlay.pipeline import run_pipelined
+except ImportError:  # run as a script: python backend/ar_overlay/overlay.py
+    from compositor import Compositor
+    from pipeline import run_pipelined
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Same detector/descriptor as the server (FEATURE_ENGINE)
+from detection.engines import get_engine
 
 # ----------------------------
 # Fetch first ad from FastAPI
@@ -33,8 +45,9 @@ if marker is None:
     print("❌ Marker image not found at", marker_path)
     exit()
 
-orb = cv2.ORB_create(1000)
-kp_marker, des_marker = orb.detectAndCompute(marker, None)
+engine = get_engine()
+kp_marker, des_marker = engine.marker_extractor().detectAndCompute(marker, None)
+extractor = engine.frame_extractor()
 
 # ----------------------------
 # Load overlay video
@@ -48,25 +61,28 @@ if not overlay_video.isOpened():
 # Initialize webcam and matcher
 # ----------------------------
 cap = cv2.VideoCapture(0)
-bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
+bf = cv2.BFMatcher(engine.norm, crossCheck=False)
 
 paused = False
 show_matches = False
 
+# Warps/blends only inside the marker's bounding box and caches resized video frames
+compositor = Compositor()
+
+# OVERLAY_PIPELINED=1 runs capture, video decode and detection in their own threads
+PIPELINED = os.environ.get("OVERLAY_PIPELINED", "0") == "1"
+
+
 # ----------------------------
-# Main loop
+# Marker detection: returns (quad or None, frame keypoints, good matches)
 # ----------------------------
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-
+def detect(frame):
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    kp_frame, des_frame = orb.detectAndCompute(gray, None)
+    kp_frame, des_frame = extractor.detectAndCompute(gray, None)
+    good = []
 
     if des_frame is not None:
         knn = bf.knnMatch(des_marker, des_frame, k=2)
-        good = []
 
         for m_n in knn:
             if len(m_n) == 2:
@@ -83,48 +99,57 @@ while True:
             if H is not None:
                 h, w = marker.shape
                 pts = np.float32([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
-                dst = cv2.perspectiveTransform(pts, H)
+                return cv2.perspectiveTransform(pts, H), kp_frame, good
 
-                # Draw outline
-                cv2.polylines(frame, [np.int32(dst)], True, (0, 255, 0), 3)
+    return None, kp_frame, good
 
-                # Get next frame from video
-                if not paused:
-                    ret_vid, vid_frame = overlay_video.read()
-                    if not ret_vid:
-                        overlay_video.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                        ret_vid, vid_frame = overlay_video.read()
-                else:
-                    ret_vid = False
 
+# ----------------------------
+# Main loop
+# ----------------------------
+if PIPELINED:
+    run_pipelined(cap, overlay_video, detect, compositor, marker, kp_marker)
+else:
+    vid_frame = None
+    vid_frame_index = -1
+
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        dst, kp_frame, good = detect(frame)
+
+        if dst is not None:
+            # Draw outline
+            cv2.polylines(frame, [np.int32(dst)], True, (0, 255, 0), 3)
+
+            # Get next frame from video (paused keeps showing the last one)
+            if not paused or vid_frame is None:
+                ret_vid, next_frame = overlay_video.read()
+                if not ret_vid:
+                    overlay_video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    ret_vid, next_frame = overlay_video.read()
                 if ret_vid:
-                    vid_frame = cv2.resize(vid_frame, (w, h))
-                    warp_matrix = cv2.getPerspectiveTransform(
-                        np.float32([[0, 0], [w, 0], [w, h], [0, h]]),
-                        dst.reshape(4, 2).astype(np.float32)
-                    )
-                    warped = cv2.warpPerspective(vid_frame, warp_matrix, (frame.shape[1], frame.shape[0]))
-
-                    mask_new = np.zeros((frame.shape[0], frame.shape[1]), dtype=np.uint8)
-                    cv2.fillConvexPoly(mask_new, np.int32(dst), 255)
-                    mask_3ch = cv2.merge([mask_new, mask_new, mask_new])
+                    vid_frame = next_frame
+                    vid_frame_index = int(overlay_video.get(cv2.CAP_PROP_POS_FRAMES))
 
-                    frame = cv2.bitwise_and(frame, 255 - mask_3ch)
-                    frame = cv2.add(frame, warped)
+            if vid_frame is not None:
+                compositor.composite(frame, vid_frame, dst, key=vid_frame_index)
 
-        if show_matches:
+        if show_matches and kp_frame:
             match_vis = cv2.drawMatches(marker, kp_marker, frame, kp_frame, good, None, flags=2)
             cv2.imshow("Matches", match_vis)
 
-    cv2.imshow("AR Overlay", frame)
+        cv2.imshow("AR Overlay", frame)
 
-    key = cv2.waitKey(1) & 0xFF
-    if key == ord('q'):
-        break
-    elif key == ord('p'):
-        paused = not paused
-    elif key == ord('m'):
-        show_matches = not show_matches
+        key = cv2.waitKey(1) & 0xFF
+        if key == ord('q'):
+            break
+        elif key == ord('p'):
+            paused = not paused
+        elif key == ord('m'):
+            show_matches = not show_matches
 
 # ----------------------------
 # Cleanup
@@ -0,0 +1,209 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# ----------------------------
+# Pipelined overlay loop.
+#
+#   capture thread  -> latest camera frame ------------+--> render (main thread)
+#                                  \--> detect thread -> latest quad --/
+#   video thread    -> ring buffer of decoded overlay frames --/
+#
+# Stages hand over through latest-value slots: a slow consumer only ever sees
+# the newest value and never makes a producer wait, so the display runs at
+# camera rate however slow detection is. The quad drawn on a frame may be a
+# few frames old when detection is slower than the camera.
+# ----------------------------
+VIDEO_RING_SIZE = 8
+REPORT_INTERVAL = 2.0
+
+
+class LatestValue:
+    """Single-slot queue that keeps only the newest value."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value = None
+        self._seq = 0
+        self._read_seq = 0
+        # Values replaced before any consumer saw them
+        self.overwritten = 0
+
+    def put(self, value):
+        with self._cond:
+            if self._seq > self._read_seq:
+                self.overwritten += 1
+            self._value = value
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, after_seq=0, timeout=None):
+        """Return (seq, value) once a value newer than after_seq exists.
+
+        Returns (after_seq, None) on timeout. Several consumers can read the
+        same value.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after_seq, timeout):
+                return after_seq, None
+            self._read_seq = self._seq
+            return self._seq, self._value
+
+
+class StageTimer:
+    """Per-stage durations, printed as mean/max ms and rate every REPORT_INTERVAL."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._last_report = time.perf_counter()
+
+    def add(self, stage, started):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._samples.setdefault(stage, []).append(elapsed)
+
+    def report(self, extra=""):
+        now = time.perf_counter()
+        window = now - self._last_report
+        if window < REPORT_INTERVAL:
+            return
+        with self._lock:
+            samples, self._samples = self._samples, {}
+        self._last_report = now
+        parts = []
+        for stage, values in samples.items():
+            parts.append(
+                f"{stage} {1000 * sum(values) / len(values):.1f}ms"
+                f" (max {1000 * max(values):.1f}, {len(values) / window:.1f}/s)"
+            )
+        print("⏱ " + " | ".join(parts) + (f" | {extra}" if extra else ""))
+
+
+class VideoRing:
+    """Overlay video decoded ahead into a small ring buffer, played back at its own fps."""
+
+    def __init__(self, video, size=VIDEO_RING_SIZE):
+        self.video = video
+        self.fps = video.get(cv2.CAP_PROP_FPS) or 30.0
+        self._frames = deque()
+        self._size = size
+        self._cond = threading.Condition()
+        self._current = None
+        self._next_due = None
+
+    def decode_loop(self, stop, timer):
+        while not stop.is_set():
+            with self._cond:
+                if not self._cond.wait_for(lambda: len(self._frames) < self._size or stop.is_set(), 0.1):
+                    continue
+            started = time.perf_counter()
+            ok, frame = self.video.read()
+            if not ok:
+                # Loop the video
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = self.video.read()
+                if not ok:
+                    break
+            index = int(self.video.get(cv2.CAP_PROP_POS_FRAMES))
+            timer.add("video", started)
+            with self._cond:
+                self._frames.append((index, frame))
+                self._cond.notify_all()
+
+    def frame_at(self, now, paused):
+        """Current (index, frame) for display time now; advances at video fps."""
+        with self._cond:
+            if self._current is None or (not paused and now >= self._next_due):
+                if self._frames:
+                    self._current = self._frames.popleft()
+                    self._next_due = (self._next_due or now) + 1.0 / self.fps
+                    # Don't try to catch up after a stall
+                    if self._next_due < now:
+                        self._next_due = now + 1.0 / self.fps
+                    self._cond.notify_all()
+            return self._current
+
+
+def run_pipelined(cap, overlay_video, detect, compositor, marker, kp_marker):
+    """Run capture, overlay decode and detection in threads and render here.
+
+    detect(frame) returns (quad or None, kp_frame, good_matches). Rendering
+    stays on the calling thread because cv2.imshow/waitKey must.
+    """
+    stop = threading.Event()
+    timer = StageTimer()
+    camera = LatestValue()
+    detections = LatestValue()
+    ring = VideoRing(overlay_video)
+
+    def capture_loop():
+        while not stop.is_set():
+            started = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                stop.set()
+                break
+            timer.add("capture", started)
+            camera.put(frame)
+
+    def detect_loop():
+        seq = 0
+        while not stop.is_set():
+            seq, frame = camera.get(seq, timeout=0.1)
+            if frame is None:
+                continue
+            started = time.perf_counter()
+            quad, kp_frame, good = detect(frame)
+            timer.add("detect", started)
+            detections.put((quad, frame, kp_frame, good))
+
+    threads = [
+        threading.Thread(target=capture_loop, name="overlay-capture", daemon=True),
+        threading.Thread(target=ring.decode_loop, args=(stop, timer), name="overlay-video", daemon=True),
+        threading.Thread(target=detect_loop, name="overlay-detect", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    paused = False
+    show_matches = False
+    camera_seq = 0
+    try:
+        while not stop.is_set():
+            camera_seq, frame = camera.get(camera_seq, timeout=0.5)
+            if frame is None:
+                continue
+            started = time.perf_counter()
+            frame = frame.copy()
+            _, detection = detections.get(0, timeout=0)
+
+            if detection is not None and detection[0] is not None:
+                quad = detection[0]
+                cv2.polylines(frame, [np.int32(quad)], True, (0, 255, 0), 3)
+                video_frame = ring.frame_at(time.perf_counter(), paused)
+                if video_frame is not None:
+                    compositor.composite(frame, video_frame[1], quad, key=video_frame[0])
+
+            if show_matches and detection is not None:
+                _, det_frame, kp_frame, good = detection
+                cv2.imshow("Matches", cv2.drawMatches(marker, kp_marker, det_frame, kp_frame, good, None, flags=2))
+
+            cv2.imshow("AR Overlay", frame)
+            timer.add("render", started)
+            timer.report(f"camera frames dropped {camera.overwritten}, detections unused {detections.overwritten}")
+
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                break
+            elif key == ord('p'):
+                paused = not paused
+            elif key == ord('m'):
+                show_matches = not show_matches
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=1.0)
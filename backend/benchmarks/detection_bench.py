@@ -0,0 +1,358 @@
+"""Offline benchmark for the /ws/detect pipeline.
+
+Builds synthetic camera frames by warping catalog markers into random
+backgrounds, registers the catalog and runs every frame through
+detection.pipeline.process_frame, the code the websocket handler runs.
+Reports the pipeline's own per-stage timings (stage_ms) as percentiles and
+detection precision/recall. Each frame starts from a fresh detection state,
+so tracking and the ROI window never kick in.
+
+The pipeline is configured like the server, through the environment
+(detection/settings.py): FEATURE_ENGINE, PYRAMID_FALLBACK, BOW_SHORTLIST,
+SHORTLIST_MIN_ADS, SHORTLIST_K... Point VOCAB_PATH at a scratch file when
+benchmarking the shortlist so the server's vocabulary is left alone.
+
+Run from the backend directory:
+
+    python -m benchmarks.detection_bench --ads 100 --frames 300
+    BOW_SHORTLIST=1 SHORTLIST_MIN_ADS=0 VOCAB_PATH=/tmp/vocabulary.npz \
+        python -m benchmarks.detection_bench --ads 1000 --frames 200
+    python -m benchmarks.detection_bench --ads 100 --engine orb,orb-500,akaze,brisk,fast-brief --recall-target 0.9
+
+With several engines each one runs in its own process (FEATURE_ENGINE set
+accordingly) on the same catalog and frames, and the summary names the
+fastest engine that reaches --recall-target.
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from detection import registry
+from detection.engines import ENGINES, get_engine
+from detection.feature_store import compute_marker_features
+from detection.index import get_catalog_index
+from detection.pipeline import new_detection_state, process_frame
+from detection.protocol import pack_frame
+from detection.registry import MarkerDetector
+from detection.settings import BOW_SHORTLIST, SHORTLIST_MIN_ADS, SHORTLIST_K, PROCESS_MAX_SIDE
+from detection.vocabulary import get_word_index
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "images")
+# stage_ms keys of detection.pipeline (tracking never runs here)
+STAGES = ["decode", "preprocess", "orb", "match", "homography", "total"]
+
+
+# ---------------------------
+# Synthetic catalog
+# ---------------------------
+def bundled_markers():
+    paths = sorted(
+        glob.glob(os.path.join(IMAGE_DIR, "*.png")) + glob.glob(os.path.join(IMAGE_DIR, "*.jp*g"))
+    )
+    markers = []
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if image is not None:
+            markers.append((os.path.basename(path), image))
+    return markers
+
+
+def random_marker(rng, size=512):
+    """Procedural 'printed ad': random shapes, lines and text on a random tint."""
+    image = np.full((size, size), rng.integers(0, 256), dtype=np.uint8)
+    for _ in range(rng.integers(15, 40)):
+        color = int(rng.integers(0, 256))
+        kind = rng.integers(0, 4)
+        x, y = rng.integers(0, size, 2)
+        if kind == 0:
+            cv2.circle(image, (int(x), int(y)), int(rng.integers(5, size // 6)), color, -1)
+        elif kind == 1:
+            x2, y2 = rng.integers(0, size, 2)
+            cv2.rectangle(image, (int(x), int(y)), (int(x2), int(y2)), color, -1)
+        elif kind == 2:
+            x2, y2 = rng.integers(0, size, 2)
+            cv2.line(image, (int(x), int(y)), (int(x2), int(y2)), color, int(rng.integers(1, 8)))
+        else:
+            text = "".join(chr(c) for c in rng.integers(65, 91, rng.integers(3, 8)))
+            cv2.putText(image, text, (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX,
+                        float(rng.uniform(0.8, 3.0)), color, int(rng.integers(1, 5)))
+    return image
+
+
+def catalog_markers(n_ads, rng):
+    """n_ads (ad_id, PNG bytes, image) entries: bundled markers, then synthetic ones."""
+    markers = bundled_markers()[:n_ads]
+    while len(markers) < n_ads:
+        markers.append((f"synthetic-{len(markers)}", random_marker(rng)))
+    return [(ad_id, cv2.imencode(".png", image)[1].tobytes(), image) for ad_id, image in markers]
+
+
+def build_catalog(markers, engine):
+    """Return ({ad_id: detector}, {ad_id: marker image}, mean ms per marker extraction)."""
+    detectors, images = {}, {}
+    started = time.perf_counter()
+    for i, (ad_id, encoded, image) in enumerate(markers):
+        features = compute_marker_features(encoded, engine)
+        if features is None or features["des"] is None:
+            continue
+        detectors[ad_id] = MarkerDetector.from_features(features, "", ad_id)
+        images[ad_id] = image
+        if (i + 1) % 500 == 0:
+            print(f"  extracted {i + 1}/{len(markers)} markers ({time.perf_counter() - started:.1f}s)")
+    marker_ms = (time.perf_counter() - started) * 1000 / max(len(markers), 1)
+    return detectors, images, marker_ms
+
+
+# ---------------------------
+# Synthetic frames
+# ---------------------------
+def random_background(rng, width, height):
+    background = rng.integers(0, 256, (height // 8, width // 8), dtype=np.uint8)
+    background = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(rng.integers(5, 20)):
+        x1, y1 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x2, y2 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        cv2.rectangle(background, (x1, y1), (x2, y2), int(rng.integers(0, 256)), -1)
+    return cv2.GaussianBlur(background, (5, 5), 0)
+
+
+def random_quad(rng, width, height, min_scale, max_scale):
+    """Random perspective quad for the marker inside the frame."""
+    side = rng.uniform(min_scale, max_scale) * min(width, height)
+    cx = rng.uniform(side / 2, width - side / 2)
+    cy = rng.uniform(side / 2, height - side / 2)
+    square = np.float32([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * side / 2
+    angle = rng.uniform(-np.pi / 6, np.pi / 6)
+    rot = np.float32([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    jitter = rng.uniform(-0.15, 0.15, (4, 2)) * side
+    quad = square @ rot.T + jitter + np.float32([cx, cy])
+    return np.clip(quad, 0, [width - 1, height - 1]).astype(np.float32)
+
+
+def make_frame(rng, image, width, height, args):
+    frame = random_background(rng, width, height)
+    box = None
+    if image is not None:
+        h, w = image.shape
+        quad = random_quad(rng, width, height, args.min_scale, args.max_scale)
+        H = cv2.getPerspectiveTransform(np.float32([[0, 0], [w, 0], [w, h], [0, h]]), quad)
+        warped = cv2.warpPerspective(image, H, (width, height))
+        mask = cv2.warpPerspective(np.full_like(image, 255), H, (width, height))
+        frame = np.where(mask > 0, warped, frame)
+        x_min, y_min = quad.min(axis=0)
+        x_max, y_max = quad.max(axis=0)
+        box = (x_min / width * 100, y_min / height * 100,
+               (x_max - x_min) / width * 100, (y_max - y_min) / height * 100)
+
+    if args.blur > 0:
+        k = int(rng.integers(0, args.blur + 1)) * 2 + 1
+        frame = cv2.GaussianBlur(frame, (k, k), 0)
+    if args.noise > 0:
+        noise = rng.normal(0, rng.uniform(0, args.noise), frame.shape)
+        frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+    ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, args.jpeg_quality])
+    return pack_frame(0, width, height, jpeg.tobytes()), box
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0.0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0.0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+# ---------------------------
+# Pipeline under test
+# ---------------------------
+def install_catalog(detectors):
+    """Register the catalog like the server does and build its indexes before timing."""
+    registry.load_snapshot(detectors)
+    get_catalog_index()
+    if not (BOW_SHORTLIST and len(detectors) >= SHORTLIST_MIN_ADS):
+        return False
+    started = time.perf_counter()
+    word_index = get_word_index()
+    while word_index.version != registry.registry_version():
+        time.sleep(0.1)
+    print(f"  visual word index ready in {time.perf_counter() - started:.1f}s")
+    return True
+
+
+def run_frame(data, max_side, timings):
+    """process_frame on a fresh state; returns (ad_id, box) or None."""
+    state = new_detection_state()
+    state["max_side"] = max_side
+    detected, state = process_frame(data, state)
+
+    stage_ms = state["stage_ms"]
+    for stage in STAGES[:-1]:
+        timings[stage].append(stage_ms.get(stage, 0.0))
+    timings["total"].append(sum(stage_ms.values()))
+    found = detected[0] if detected else None
+    return found and (found["id"], (found["x"], found["y"], found["width"], found["height"]))
+
+
+def report(timings, stats, args, n_ads, engine, shortlist):
+    print()
+    print(f"engine={engine.name} ads={n_ads} frames={stats['frames']} frame={args.width}x{args.height} "
+          f"max_side={args.max_side} features={engine.frame_features} "
+          f"max_distance={engine.max_distance} min_score={engine.min_score} "
+          f"shortlist={SHORTLIST_K if shortlist else 0}")
+    print(f"{'stage':<12}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for stage in STAGES:
+        values = np.asarray(timings[stage])
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        print(f"{stage:<12}{p50:>10.2f}{p90:>10.2f}{p99:>10.2f}{values.mean():>10.2f}")
+
+    detections = stats["tp"] + stats["fp"]
+    precision = stats["tp"] / detections if detections else 0.0
+    recall = stats["tp"] / stats["positives"] if stats["positives"] else 0.0
+    print(f"precision={precision:.3f} recall={recall:.3f} "
+          f"(tp={stats['tp']} fp={stats['fp']} positives={stats['positives']})")
+    return precision, recall
+
+
+def run_engine(markers, frames, args):
+    """Benchmark the configured engine (FEATURE_ENGINE); returns its summary row."""
+    engine = get_engine()
+    cv2.setRNGSeed(args.seed)
+    print(f"[{engine.name}] building catalog of {len(markers)} ads...")
+    detectors, _, marker_ms = build_catalog(markers, engine.name)
+    shortlist = install_catalog(detectors)
+
+    timings = {stage: [] for stage in STAGES}
+    stats = {"frames": 0, "tp": 0, "fp": 0, "positives": 0}
+    frames = [frame for frame in frames if frame[2] is None or frame[2] in detectors]
+
+    print(f"[{engine.name}] running {len(frames)} frames...")
+    for data, box, truth in frames:
+        result = run_frame(data, args.max_side, timings)
+        stats["frames"] += 1
+        stats["positives"] += truth is not None
+        if result is not None:
+            ad_id, found_box = result
+            if ad_id == truth and iou(found_box, box) >= args.iou:
+                stats["tp"] += 1
+            else:
+                stats["fp"] += 1
+
+    precision, recall = report(timings, stats, args, len(detectors), engine, shortlist)
+    return {
+        "engine": engine.name,
+        "marker_ms": marker_ms,
+        "extract_ms": float(np.mean(timings["orb"])),
+        "match_ms": float(np.mean(timings["match"])),
+        "total_ms": float(np.mean(timings["total"])),
+        "precision": precision,
+        "recall": recall,
+    }
+
+
+def run_engine_process(name, argv):
+    """Re-run this benchmark for one engine in a child process with FEATURE_ENGINE=name."""
+    with tempfile.TemporaryDirectory() as tmp:
+        summary = os.path.join(tmp, "summary.json")
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.detection_bench", *argv, "--summary", summary],
+            env={**os.environ, "FEATURE_ENGINE": name}, check=True,
+        )
+        with open(summary) as f:
+            return json.load(f)
+
+
+def without_engine(argv):
+    """argv minus the --engine option."""
+    kept, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == "--engine":
+            skip = True
+        elif not arg.startswith("--engine="):
+            kept.append(arg)
+    return kept
+
+
+def report_engines(rows, recall_target):
+    print()
+    print(f"{'engine':<12}{'marker ms':>11}{'extract ms':>12}{'match ms':>10}{'total ms':>10}"
+          f"{'precision':>11}{'recall':>8}")
+    for row in rows:
+        print(f"{row['engine']:<12}{row['marker_ms']:>11.2f}{row['extract_ms']:>12.2f}{row['match_ms']:>10.2f}"
+              f"{row['total_ms']:>10.2f}{row['precision']:>11.3f}{row['recall']:>8.3f}")
+    qualifying = [row for row in rows if row["recall"] >= recall_target]
+    if qualifying:
+        best = min(qualifying, key=lambda row: row["total_ms"])
+        print(f"fastest engine with recall >= {recall_target}: {best['engine']} ({best['total_ms']:.2f} ms/frame)")
+    else:
+        print(f"no engine reached recall {recall_target}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ads", type=int, default=10, help="catalog size (bundled markers + synthetic)")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--negatives", type=float, default=0.2, help="fraction of frames with no ad")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--min-scale", type=float, default=0.3, help="marker side as a fraction of the frame")
+    parser.add_argument("--max-scale", type=float, default=0.8)
+    parser.add_argument("--blur", type=int, default=2, help="max Gaussian blur radius")
+    parser.add_argument("--noise", type=float, default=8.0, help="max Gaussian noise sigma")
+    parser.add_argument("--jpeg-quality", type=int, default=70)
+    parser.add_argument("--engine", default=None,
+                        help=f"comma-separated feature engines ({', '.join(ENGINES)}); default FEATURE_ENGINE")
+    parser.add_argument("--recall-target", type=float, default=0.9,
+                        help="with several engines, report the fastest one reaching this recall")
+    parser.add_argument("--max-side", type=int, default=PROCESS_MAX_SIDE, help="processing long side (0 = full frame)")
+    parser.add_argument("--iou", type=float, default=0.5, help="box IoU for a correct detection")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--summary", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    engines = args.engine.split(",") if args.engine else [get_engine().name]
+    for name in engines:
+        get_engine(name)
+    if engines != [get_engine().name]:
+        # The pipeline uses the configured engine: one process per engine
+        argv = without_engine(sys.argv[1:])
+        rows = [run_engine_process(name, argv) for name in engines]
+        if len(rows) > 1:
+            report_engines(rows, args.recall_target)
+        return
+
+    rng = np.random.default_rng(args.seed)
+    cv2.setRNGSeed(args.seed)
+
+    # Catalog images and frames only depend on the seed, so every engine sees the same ones
+    markers = catalog_markers(args.ads, rng)
+    print(f"Rendering {args.frames} frames...")
+    frames = []
+    for _ in range(args.frames):
+        if rng.random() < args.negatives:
+            truth, image = None, None
+        else:
+            truth, _, image = markers[int(rng.integers(0, len(markers)))]
+        data, box = make_frame(rng, image, args.width, args.height, args)
+        frames.append((data, box, truth))
+
+    row = run_engine(markers, frames, args)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(row, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Check CatalogIndex.best_match against the original per-ad matching loop.
+
+Builds a catalog (bundled markers + synthetic ones), renders frames with and
+without a marker, and for every frame compares the index result with the
+per-ad BFMatcher(crossCheck=True) loop it replaces: same ad, same score, same
+matched pairs. Prints the matching time of both. Exits non-zero on a mismatch.
+
+Run from the backend directory:
+
+    python -m benchmarks.index_check --ads 10 --frames 50
+    python -m benchmarks.index_check --ads 1000 --frames 50
+"""
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.detection_bench import build_catalog, catalog_markers, make_frame
+from detection.engines import get_engine
+from detection.index import CatalogIndex
+from detection.protocol import decode_message
+
+
+def baseline_best_match(detectors, des_frame, engine):
+    """The per-ad loop CatalogIndex replaced (same thresholds, same tie-breaking)."""
+    bf = cv2.BFMatcher(engine.norm, crossCheck=True)
+    best, best_score = None, 0
+    for ad_id, detector in detectors.items():
+        if detector.des is None or len(detector) <= 8:
+            continue
+        good = [m for m in bf.match(detector.des, des_frame) if m.distance < engine.max_distance]
+        if len(good) > engine.min_good:
+            score = len(good) / len(detector)
+            if score > best_score:
+                best, best_score = (ad_id, good), score
+    if best is None or best_score <= engine.min_score:
+        return None
+    ad_id, good = best
+    return ad_id, best_score, {(m.queryIdx, m.trainIdx) for m in good}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ads", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--engine", default=None, help="feature engine (default FEATURE_ENGINE)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # make_frame's rendering options
+    args.min_scale, args.max_scale, args.blur, args.noise, args.jpeg_quality = 0.3, 0.8, 2, 8.0, 70
+
+    engine = get_engine(args.engine)
+    rng = np.random.default_rng(args.seed)
+    cv2.setRNGSeed(args.seed)
+    markers = catalog_markers(args.ads, rng)
+    detectors, images, _ = build_catalog(markers, engine.name)
+    index = CatalogIndex(detectors, engine=engine.name)
+    ad_ids = list(images)
+    extractor = engine.frame_extractor()
+
+    index_ms, baseline_ms = [], []
+    mismatches = found = 0
+    for i in range(args.frames):
+        image = images[ad_ids[i % len(ad_ids)]] if i % 5 else None
+        data, _ = make_frame(rng, image, 1280, 720, args)
+        _, gray = decode_message(data)
+        _, des_frame = extractor.detectAndCompute(cv2.resize(gray, (640, 360), interpolation=cv2.INTER_AREA), None)
+        if des_frame is None:
+            continue
+
+        started = time.perf_counter()
+        result = index.best_match(des_frame)
+        index_ms.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        expected = baseline_best_match(detectors, des_frame, engine)
+        baseline_ms.append((time.perf_counter() - started) * 1000)
+
+        if result is not None:
+            found += 1
+            ad_id, score, query_idx, train_idx = result
+            result = ad_id, score, set(zip(query_idx.tolist(), train_idx.tolist()))
+        same = (result is None) == (expected is None) and (
+            result is None
+            or (result[0] == expected[0] and np.isclose(result[1], expected[1]) and result[2] == expected[2])
+        )
+        if not same:
+            mismatches += 1
+            print(f"frame {i}: index={result and result[:2]} baseline={expected and expected[:2]}")
+
+    print(f"engine={engine.name} ads={len(detectors)} frames={len(index_ms)} detected={found} mismatches={mismatches}")
+    for name, values in (("index", index_ms), ("per-ad loop", baseline_ms)):
+        p50, p90 = np.percentile(values, [50, 90])
+        print(f"{name:<12} p50 {p50:8.2f} ms  p90 {p90:8.2f} ms  mean {np.mean(values):8.2f} ms")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
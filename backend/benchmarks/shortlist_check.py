@@ -0,0 +1,87 @@
+"""Measure the recall of the visual-word shortlist by catalog size.
+
+For every catalog size, trains a vocabulary on the catalog, renders frames of
+random catalog ads and counts how often the true ad is among the top-K ads
+of the shortlist. Only frames where the true ad alone gets more than the
+engine's min_good cross-checked matches are counted (any score), so the numbers
+are the recall lost to shortlisting. Use it to choose SHORTLIST_MIN_ADS and
+SHORTLIST_K.
+
+Run from the backend directory:
+
+    python -m benchmarks.shortlist_check --ads 50,200,500 --k 5,20,50 --frames 100
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.detection_bench import build_catalog, catalog_markers, make_frame
+from detection.engines import get_engine
+from detection.index import CatalogIndex
+from detection.protocol import decode_message
+from detection.vocabulary import VocabularyTree, VisualWordIndex
+from detection.settings import VOCAB_SAMPLE
+
+
+def build_word_index(detectors, engine):
+    descriptors = np.vstack([detector.des for detector in detectors.values()])
+    if len(descriptors) > VOCAB_SAMPLE:
+        descriptors = descriptors[np.random.default_rng(0).choice(len(descriptors), VOCAB_SAMPLE, replace=False)]
+    word_index = VisualWordIndex(VocabularyTree.train(descriptors, len(detectors), norm=engine.norm))
+    word_index.sync(detectors, 0)
+    return word_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ads", default="50,200,500", help="comma-separated catalog sizes")
+    parser.add_argument("--k", default="5,20,50", help="comma-separated shortlist lengths")
+    parser.add_argument("--frames", type=int, default=100, help="positive frames per catalog size")
+    parser.add_argument("--engine", default=None, help="feature engine (default FEATURE_ENGINE)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # make_frame's rendering options (as detection_bench's defaults)
+    args.min_scale, args.max_scale, args.blur, args.noise, args.jpeg_quality = 0.3, 0.8, 2, 8.0, 70
+    sizes = [int(n) for n in args.ads.split(",")]
+    ks = [int(k) for k in args.k.split(",")]
+
+    engine = get_engine(args.engine)
+    extractor = engine.frame_extractor()
+    rng = np.random.default_rng(args.seed)
+    cv2.setRNGSeed(args.seed)
+    # Larger catalogs extend the smaller ones
+    all_detectors, all_images, _ = build_catalog(catalog_markers(max(sizes), rng), engine.name)
+    all_ids = list(all_detectors)
+
+    print(f"{'ads':>6}{'frames':>8}" + "".join(f"{f'recall@{k}':>12}" for k in ks) + f"{'ms/frame':>10}")
+    for size in sizes:
+        detectors = {ad_id: all_detectors[ad_id] for ad_id in all_ids[:size]}
+        index = CatalogIndex(detectors, engine=engine.name)
+        word_index = build_word_index(detectors, engine)
+
+        hits = dict.fromkeys(ks, 0)
+        counted = 0
+        elapsed = []
+        for _ in range(args.frames):
+            truth = all_ids[int(rng.integers(0, len(detectors)))]
+            data, _ = make_frame(rng, all_images[truth], 1280, 720, args)
+            _, gray = decode_message(data)
+            small = cv2.resize(gray, (640, 360), interpolation=cv2.INTER_AREA)
+            _, des_frame = extractor.detectAndCompute(small, None)
+            if des_frame is None or index.best_match_among(des_frame, [truth], min_score=0) is None:
+                continue
+            counted += 1
+            started = time.perf_counter()
+            candidates = word_index.shortlist(des_frame, max(ks))
+            elapsed.append((time.perf_counter() - started) * 1000)
+            for k in ks:
+                hits[k] += truth in candidates[:k]
+
+        recalls = "".join(f"{hits[k] / counted if counted else 0.0:>12.3f}" for k in ks)
+        print(f"{len(detectors):>6}{counted:>8}{recalls}{np.mean(elapsed) if elapsed else 0.0:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# ---------------------------
+# Ad catalog listing: _id cursor pagination, field projection, and a
+# version counter (one small document in Mongo, shared by every process)
+# that is bumped on every change so unchanged polls can get a 304.
+# ---------------------------
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+SCAN_BATCH_SIZE = 200
+
+# Fields a client may ask for with ?fields=; _id is always returned
+LISTABLE_FIELDS = {
+    "name", "description", "imageUrl", "videoUrl", "status", "error",
+    "featureCount", "videoStatus", "renditions", "posterUrl", "previewUrl", "previewMimeType",
+    "durationSeconds", "imageSize", "videoSize",
+}
+
+# Ads without a status predate background processing and are ready
+READY_QUERY = {"status": {"$in": [None, "ready"]}}
+
+_VERSION_ID = "catalog"
+
+
+async def catalog_version(db):
+    doc = await db["meta"].find_one({"_id": _VERSION_ID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+
+async def bump_catalog_version(db):
+    await db["meta"].update_one({"_id": _VERSION_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+
+async def catalog_cache_headers(db, request):
+    """ETag/Cache-Control headers for a catalog listing, and whether the
+    request's If-None-Match already names that ETag (answer 304).
+
+    Call it before reading the page so a concurrent change can only make the
+    ETag stale, never too new.
+    """
+    etag = f'"catalog-{await catalog_version(db)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    not_modified = etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    return headers, not_modified
+
+
+def parse_fields(fields):
+    """Turn "name,videoUrl" into a Mongo projection; None means all fields."""
+    if not fields:
+        return None
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - LISTABLE_FIELDS - {"_id"}
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {name: 1 for name in names}
+
+
+async def list_ads(collection, after=None, limit=DEFAULT_PAGE_SIZE, fields=None):
+    """One page of ads ordered by _id.
+
+    Returns (ads, next_cursor); next_cursor is None on the last page.
+    Raises ValueError for a bad cursor, limit or field name.
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    query = {}
+    if after:
+        try:
+            query["_id"] = {"$gt": ObjectId(after)}
+        except InvalidId:
+            raise ValueError("Invalid cursor")
+
+    # One extra document tells us whether there's a next page
+    ads = await collection.find(query, parse_fields(fields)).sort("_id", 1).to_list(limit + 1)
+    next_cursor = None
+    if len(ads) > limit:
+        ads = ads[:limit]
+        next_cursor = str(ads[-1]["_id"])
+    for ad in ads:
+        ad["_id"] = str(ad["_id"])
+    return ads, next_cursor
+
+
+async def iter_ad_batches(collection, query=None, projection=None, batch_size=SCAN_BATCH_SIZE):
+    """Yield lists of at most batch_size ads from one server-side cursor."""
+    cursor = collection.find(query or {}, projection).batch_size(batch_size)
+    batch = []
+    async for ad in cursor:
+        batch.append(ad)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -12,8 +12,11 @@
 import os
 import motor.motor_asyncio
 from motor.motor_asyncio import AsyncIOMotorGridFSBucket
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.responses import JSONResponse
+from uploads import UploadLimitMiddleware, check_upload, upload_to_gridfs, MAX_IMAGE_BYTES, MAX_VIDEO_BYTES
+from media_stream import gridfs_response
+from catalog import bump_catalog_version
 
 # ------------------------------
 # MongoDB connection
@@ -36,6 +39,8 @@ fs = AsyncIOMotorGridFSBucket(db)
 # FastAPI app
 # ------------------------------
 app = FastAPI()
+# Refuse oversized uploads before Starlette spools them
+app.add_middleware(UploadLimitMiddleware)
 
 @app.post("/api/ads")
 async def create_ad(
@@ -44,34 +49,56 @@ async def create_ad(
     image: UploadFile = File(...),
     video: UploadFile = File(...),
 ):
-    # Store image in GridFS
-    image_id = await fs.upload_from_stream(
-        image.filename, 
-        await image.read(),
+    # Check both files before storing either
+    check_upload(image, "image")
+    check_upload(video, "video")
+
+    # Store image in GridFS, streamed in chunks
+    image_id, image_size, image_sha256 = await upload_to_gridfs(
+        fs, image, MAX_IMAGE_BYTES,
         metadata={"content_type": image.content_type}
     )
     
     # Store video in GridFS
-    video_id = await fs.upload_from_stream(
-        video.filename, 
-        await video.read(),
-        metadata={"content_type": video.content_type}
-    )
-    
-    # Save references in MongoDB
-    doc = {
-        "name": name,
-        "description": description,
-        "imageId": str(image_id),
-        "videoId": str(video_id),
-        "imageUrl": f"/api/images/{image_id}",
-        "videoUrl": f"/api/videos/{video_id}",
-    }
+    stored = [image_id]
+    try:
+        video_id, video_size, video_sha256 = await upload_to_gridfs(
+            fs, video, MAX_VIDEO_BYTES,
+            metadata={"content_type": video.content_type}
+        )
+        stored.append(video_id)
 
-    result = await ads_collection.insert_one(doc)
+        # Save references in MongoDB
+        doc = {
+            "name": name,
+            "description": description,
+            "imageId": str(image_id),
+            "videoId": str(video_id),
+            "imageUrl": f"/api/images/{image_id}",
+            "videoUrl": f"/api/videos/{video_id}",
+            "imageSize": image_size,
+            "imageSha256": image_sha256,
+            "videoSize": video_size,
+            "videoSha256": video_sha256,
+        }
+        result = await ads_collection.insert_one(doc)
+    except BaseException:
+        # Don't leave files behind for an ad that doesn't exist
+        for file_id in stored:
+            await fs.delete(file_id)
+        raise
+    await bump_catalog_version(db)
     doc["_id"] = str(result.inserted_id)
 
     return JSONResponse(content=doc)
 
+# ------------------------------
+# Serve GridFS media (streamed, with Range support for video seeking)
+# ------------------------------
+@app.get("/api/images/{file_id}")
+async def get_image(file_id: str, request: Request):
+    return await gridfs_response(fs, file_id, request)
 
-
+@app.get("/api/videos/{file_id}")
+async def get_video(file_id: str, request: Request):
+    return await gridfs_response(fs, file_id, request)
@@ -0,0 +1,118 @@
+import cv2
+
+from detection.settings import FEATURE_ENGINE, MARKER_FEATURES, FRAME_FEATURES
+
+# ---------------------------
+# Feature engines: detector + descriptor + the matching thresholds that go
+# with them. Everything downstream (catalog index, vocabulary, shared store)
+# works on binary descriptors compared with Hamming distance, so every engine
+# here produces those; only the descriptor width and thresholds differ.
+#
+#   orb         ORB, MARKER_FEATURES / FRAME_FEATURES keypoints (default)
+#   orb-500     ORB, 500 / 400 keypoints
+#   orb-2000    ORB, 2000 / 1500 keypoints
+#   akaze       AKAZE (MLDB descriptor, 61 bytes)
+#   brisk       BRISK (64 bytes)
+#   fast-brief  FAST corners + BRIEF (xfeatures2d when installed, otherwise
+#               ORB's BRIEF pattern without orientation); fastest, not
+#               rotation invariant
+#
+# benchmarks/detection_bench.py --engine compares them on extraction and
+# match cost and recall.
+# ---------------------------
+
+
+class _DetectThenDescribe:
+    """detectAndCompute() for detectors without a feature count limit.
+
+    Keeps the max_features strongest keypoints before describing them, so
+    extraction and matching cost stay bounded on busy frames.
+    """
+
+    def __init__(self, detector, extractor, max_features):
+        self.detector = detector
+        self.extractor = extractor
+        self.max_features = max_features
+
+    def detectAndCompute(self, image, mask):
+        keypoints = self.detector.detect(image, mask)
+        if len(keypoints) > self.max_features:
+            keypoints = sorted(keypoints, key=lambda kp: kp.response, reverse=True)[:self.max_features]
+        if not keypoints:
+            return (), None
+        return self.extractor.compute(image, keypoints)
+
+
+def _brief_extractor():
+    xfeatures2d = getattr(cv2, "xfeatures2d", None)
+    if xfeatures2d is not None and hasattr(xfeatures2d, "BriefDescriptorExtractor_create"):
+        return xfeatures2d.BriefDescriptorExtractor_create(32)
+    return cv2.ORB_create()
+
+
+class FeatureEngine:
+    """One detector/descriptor configuration.
+
+    make(n) returns a new extractor with detectAndCompute(image, mask) keeping
+    about n keypoints. Extractors aren't thread-safe; callers keep one per
+    thread. max_distance, min_good and min_score are the catalog matching
+    thresholds for this descriptor (see CatalogIndex.best_match).
+    """
+
+    def __init__(self, name, make, marker_features, frame_features, descriptor_bytes,
+                 max_distance, min_good=12, min_score=0.15, norm=cv2.NORM_HAMMING):
+        self.name = name
+        self.make = make
+        self.marker_features = marker_features
+        self.frame_features = frame_features
+        self.descriptor_bytes = descriptor_bytes
+        self.max_distance = max_distance
+        self.min_good = min_good
+        self.min_score = min_score
+        self.norm = norm
+
+    @property
+    def params(self):
+        """Everything that changes marker features, for the feature cache key."""
+        return {"detector": self.name, "nfeatures": self.marker_features}
+
+    def marker_extractor(self):
+        return self.make(self.marker_features)
+
+    def frame_extractor(self):
+        return self.make(self.frame_features)
+
+    def matcher(self):
+        return cv2.BFMatcher(self.norm, crossCheck=True)
+
+
+ENGINES = {
+    engine.name: engine
+    for engine in (
+        FeatureEngine("orb", cv2.ORB_create, MARKER_FEATURES, FRAME_FEATURES, 32, max_distance=50),
+        FeatureEngine("orb-500", cv2.ORB_create, 500, 400, 32, max_distance=50),
+        FeatureEngine("orb-2000", cv2.ORB_create, 2000, 1500, 32, max_distance=50),
+        FeatureEngine(
+            "akaze", lambda n: _DetectThenDescribe(cv2.AKAZE_create(), cv2.AKAZE_create(), n),
+            1000, 800, 61, max_distance=95,
+        ),
+        FeatureEngine(
+            "brisk", lambda n: _DetectThenDescribe(cv2.BRISK_create(), cv2.BRISK_create(), n),
+            1000, 800, 64, max_distance=100,
+        ),
+        FeatureEngine(
+            "fast-brief",
+            lambda n: _DetectThenDescribe(cv2.FastFeatureDetector_create(20), _brief_extractor(), n),
+            1000, 800, 32, max_distance=50,
+        ),
+    )
+}
+
+
+def get_engine(name=None):
+    """The engine called name, or the configured FEATURE_ENGINE."""
+    name = name or FEATURE_ENGINE
+    engine = ENGINES.get(name)
+    if engine is None:
+        raise ValueError(f"Unknown feature engine: {name} (available: {', '.join(ENGINES)})")
+    return engine
@@ -0,0 +1,173 @@
+import asyncio
+import glob
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from detection import registry
+from detection.pipeline import process_frame
+from detection.settings import DETECTION_EXECUTOR, DETECTION_WORKERS
+
+
+# Most changed ads a registry delta file may hold before the pool is rebuilt
+# from a fresh snapshot instead (the cumulative delta is rewritten on every
+# registry change and read once by every worker)
+MAX_SHIPPED_CHANGES = 256
+# Delta files kept per pool, so tasks queued before a newer change still find theirs
+KEEP_DELTA_FILES = 4
+
+# Parent registry version this worker process's copy matches
+_worker_version = None
+
+
+def _init_worker(snapshot, version):
+    # Runs once in every worker process
+    global _worker_version
+    _load(snapshot)
+    _worker_version = version
+
+
+def _load(snapshot):
+    if isinstance(snapshot, tuple) and snapshot[0] == "shared":
+        # Map the shared catalog instead of unpickling a copy of it
+        from detection import shared_store
+        if shared_store.attached_generation() != snapshot[1]:
+            shared_store.attach(snapshot[1])
+    else:
+        registry.load_snapshot(snapshot)
+
+
+def _sync_worker(update):
+    """Bring this worker's registry up to the parent version shipped with a task."""
+    global _worker_version
+    if update is None or update[0] == _worker_version:
+        return
+    version, kind, payload = update
+    if kind == "shared":
+        _load(("shared", payload))
+    else:
+        # Cumulative delta since the pool's snapshot, so applying it twice is harmless
+        try:
+            with open(payload, "rb") as f:
+                changes = pickle.load(f)
+        except FileNotFoundError:
+            # Superseded (or the pool is being replaced): a later task brings a newer one
+            return
+        for ad_id, detector in changes.items():
+            if detector is None:
+                registry.unregister_detector(ad_id)
+            else:
+                registry.register_detector(ad_id, detector)
+    _worker_version = version
+
+
+def _process_frame(update, data, state):
+    _sync_worker(update)
+    return process_frame(data, state)
+
+
+class DetectionExecutor:
+    """Runs process_frame off the event loop.
+
+    In process mode the pool is kept across registry changes: every task
+    carries the parent's registry version plus where to find what changed
+    since the pool was started (a shared_store generation to attach, or a
+    file with the changed ads), and workers catch up once per version before
+    detecting. Only a delta too large for that rebuilds the pool.
+    """
+
+    def __init__(self, mode=DETECTION_EXECUTOR, workers=DETECTION_WORKERS):
+        if mode not in ("inline", "thread", "process"):
+            raise ValueError(f"Unknown detection executor mode: {mode}")
+        self.mode = mode
+        self.workers = max(1, workers)
+        self._pool = None
+        self._pool_version = None
+        self._update = None
+        self._delta_dir = None
+
+    def _get_pool(self):
+        if self.mode == "thread":
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="detect"
+                )
+            return self._pool
+
+        if self._pool is None or self._worker_update() is False:
+            self._start_processes()
+        return self._pool
+
+    def _start_processes(self):
+        if self._pool is not None:
+            # Let in-flight frames finish on the old pool
+            self._pool.shutdown(wait=False)
+        version = registry.registry_version()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(registry.snapshot_registry(), version),
+        )
+        self._pool_version = version
+        self._update = None
+        # Deltas are relative to the pool's snapshot: start a fresh directory
+        self._remove_deltas()
+        self._delta_dir = tempfile.mkdtemp(prefix="detection-delta-")
+        print(f"Started {self.workers} detection processes (registry v{version})")
+
+    def _worker_update(self):
+        """Update to ship with the next task: None if workers are current, False if
+        the delta is too large and the pool has to be rebuilt."""
+        version = registry.registry_version()
+        if version == self._pool_version:
+            return None
+        if self._update is not None and self._update[0] == version:
+            return self._update
+
+        generation = registry.shared_generation()
+        if generation is not None:
+            self._update = (version, "shared", generation)
+            return self._update
+        changes = registry.changes_since(self._pool_version)
+        if changes is None or len(changes) > MAX_SHIPPED_CHANGES:
+            return False
+        self._update = (version, "changes", self._write_delta(version, changes))
+        return self._update
+
+    def _write_delta(self, version, changes):
+        """Write the delta for version next to the pool's previous ones; returns its path."""
+        path = os.path.join(self._delta_dir, f"delta-{version}.pkl")
+        fd, tmp_path = tempfile.mkstemp(dir=self._delta_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(changes, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        paths = sorted(
+            glob.glob(os.path.join(self._delta_dir, "delta-*.pkl")),
+            key=lambda p: int(os.path.basename(p)[6:-4]),
+        )
+        for old in paths[:-KEEP_DELTA_FILES]:
+            os.remove(old)
+        return path
+
+    def _remove_deltas(self):
+        if self._delta_dir is not None:
+            shutil.rmtree(self._delta_dir, ignore_errors=True)
+            self._delta_dir = None
+
+    async def run(self, data, state):
+        if self.mode == "inline":
+            return process_frame(data, state)
+        loop = asyncio.get_running_loop()
+        if self.mode == "thread":
+            return await loop.run_in_executor(self._get_pool(), process_frame, data, state)
+        pool = self._get_pool()
+        return await loop.run_in_executor(pool, _process_frame, self._worker_update(), data, state)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self._remove_deltas()
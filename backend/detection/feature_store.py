@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from detection.engines import get_engine
+from detection.settings import MARKER_SIZE, FEATURE_STORE_DIR, FEATURE_LOAD_WORKERS
+
+
+def feature_params(engine=None):
+    """Anything that changes the computed features must be part of the cache key.
+
+    The engine's parameters are included, so every engine caches its own
+    features for the same image.
+    """
+    return {**get_engine(engine).params, "size": MARKER_SIZE, "version": 1}
+
+
+def feature_key(image_bytes, params=None):
+    digest = hashlib.sha256(image_bytes)
+    digest.update(json.dumps(params or feature_params(), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def compute_marker_features(image_bytes, engine=None):
+    """Decode a marker image and extract keypoints/descriptors with the feature engine.
+
+    Returns {"pts", "des", "shape"} or None if the image can't be decoded.
+    """
+    marker = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if marker is None:
+        return None
+    # Resize image to standard size for consistent feature detection
+    marker = cv2.resize(marker, (MARKER_SIZE, MARKER_SIZE))
+    extractor = get_engine(engine).marker_extractor()
+    kp_marker, des_marker = extractor.detectAndCompute(marker, None)
+    pts = cv2.KeyPoint_convert(kp_marker) if kp_marker else np.empty((0, 2), dtype=np.float32)
+    return {"pts": pts.reshape(-1, 2), "des": des_marker, "shape": marker.shape}
+
+
+# ---------------------------
+# .npz persistence
+# ---------------------------
+def _store_path(key):
+    return os.path.join(FEATURE_STORE_DIR, key[:2], f"{key}.npz")
+
+
+def save_features(key, features, engine=None):
+    path = _store_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    des = features["des"]
+    if des is None:
+        des = np.empty((0, get_engine(engine).descriptor_bytes), dtype=np.uint8)
+
+    # Write to a temp file and rename so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                pts=np.float32(features["pts"]).reshape(-1, 2),
+                des=des,
+                shape=np.int32(features["shape"]),
+            )
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_features(key):
+    path = _store_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            pts, des = data["pts"], data["des"]
+            shape = tuple(int(v) for v in data["shape"])
+    except Exception as e:
+        print(f"Ignoring unreadable feature cache {path}: {e}")
+        return None
+
+    return {"pts": pts, "des": des if len(des) else None, "shape": shape}
+
+
+def load_or_compute(image_path, engine=None):
+    """Return cached features for an image, computing and storing them on a miss."""
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+    key = feature_key(image_bytes, feature_params(engine))
+
+    features = load_features(key)
+    if features is not None:
+        return features, True
+
+    features = compute_marker_features(image_bytes, engine)
+    if features is not None:
+        try:
+            save_features(key, features, engine)
+        except OSError as e:
+            print(f"Could not write feature cache for {image_path}: {e}")
+    return features, False
+
+
+async def load_many(image_paths, workers=FEATURE_LOAD_WORKERS, progress_every=50):
+    """Load features for many images in parallel, printing progress.
+
+    Returns a list aligned with image_paths; entries are None on failure.
+    """
+    loop = asyncio.get_running_loop()
+    total = len(image_paths)
+    results = [None] * total
+    done = hits = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="features") as pool:
+        futures = {
+            loop.run_in_executor(pool, load_or_compute, path): i
+            for i, path in enumerate(image_paths)
+        }
+        pending = set(futures)
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                i = futures[future]
+                done += 1
+                try:
+                    features, cached = future.result()
+                    results[i] = features
+                    hits += cached
+                except Exception as e:
+                    print(f"Error loading features for {image_paths[i]}: {e}")
+                if done % progress_every == 0 or done == total:
+                    print(f"Loaded marker features {done}/{total} ({hits} from cache)")
+    return results
@@ -0,0 +1,199 @@
+import threading
+
+import cv2
+import numpy as np
+
+from detection import registry
+from detection.engines import get_engine
+from detection.settings import BOW_SHORTLIST, SHORTLIST_MIN_ADS, SHORTLIST_K
+from detection.vocabulary import get_word_index
+
+
+class CatalogIndex:
+    """All ad descriptors packed into one uint8 matrix with an ad label per row.
+
+    Frames are matched against the whole catalog with one nearest-neighbour
+    batchDistance call (see match), and ads are scored with bincount over the
+    labels of the good matches.
+    Matching reproduces the old per-ad BFMatcher(NORM_HAMMING, crossCheck=True)
+    result: a pair is kept when the frame descriptor is the nearest neighbour of
+    the ad descriptor and that ad descriptor is the nearest one *within its ad*.
+    Thresholds left as None come from the feature engine.
+    """
+
+    def __init__(self, detectors, engine=None):
+        self.engine = get_engine(engine)
+        ad_ids, blocks = [], []
+        for ad_id, detector in detectors.items():
+            # Same eligibility rule as the old per-ad loop
+            if detector.des is None or len(detector) <= 8:
+                continue
+            ad_ids.append(ad_id)
+            blocks.append(detector.des)
+
+        if blocks:
+            descriptors = np.vstack(blocks)
+        else:
+            descriptors = np.empty((0, self.engine.descriptor_bytes), dtype=np.uint8)
+        self._set_packed(ad_ids, descriptors, [len(block) for block in blocks])
+
+    @classmethod
+    def from_packed(cls, ad_ids, descriptors, sizes, engine=None):
+        """Wrap an already packed descriptor matrix (e.g. a memory map) without copying.
+
+        Every ad must be eligible (more than 8 descriptors), rows grouped by ad in
+        ad_ids order.
+        """
+        index = cls.__new__(cls)
+        index.engine = get_engine(engine)
+        index._set_packed(list(ad_ids), descriptors, sizes)
+        return index
+
+    def _set_packed(self, ad_ids, descriptors, sizes):
+        sizes = np.asarray(sizes, dtype=np.int64)
+        self.ad_ids = ad_ids
+        self._position = {ad_id: i for i, ad_id in enumerate(ad_ids)}
+        self.n_kp = sizes.astype(np.float64)
+        self.descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+        self.offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        self.labels = np.repeat(np.arange(len(sizes), dtype=np.int32), sizes)
+        self.local_idx = (np.arange(len(self.labels)) - self.offsets[self.labels]).astype(np.int32)
+
+    def __len__(self):
+        return len(self.ad_ids)
+
+    def match(self, des_frame, max_distance=None, min_votes=0):
+        """Return (rows, frame_idx) of every good catalog/frame descriptor pair.
+
+        Forward pass: one batchDistance(K=1) over the whole catalog gives every
+        row its nearest frame descriptor. Only rows closer than max_distance can
+        be good, so the backward pass (nearest row *within the ad* for each of
+        those frame descriptors) runs per ad on just those candidates. Ads with
+        no more than min_votes candidates can't win and are skipped.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if max_distance is None:
+            max_distance = self.engine.max_distance
+        if not self.ad_ids or des_frame is None or not len(des_frame):
+            return empty, empty
+        des_frame = np.ascontiguousarray(des_frame, dtype=np.uint8)
+
+        dist, nearest = cv2.batchDistance(
+            self.descriptors, des_frame, cv2.CV_32S, normType=self.engine.norm, K=1,
+        )
+        candidates = np.flatnonzero(dist[:, 0] < max_distance)
+        if not len(candidates):
+            return empty, empty
+        nearest = nearest[candidates, 0]
+
+        # Candidates are sorted by row, so they're already grouped by ad
+        ads, starts, counts = np.unique(self.labels[candidates], return_index=True, return_counts=True)
+        rows_out, frame_out = [], []
+        for ad, start, count in zip(ads, starts, counts):
+            if count <= min_votes:
+                continue
+            rows = candidates[start:start + count]
+            cols = nearest[start:start + count]
+            lo, hi = self.offsets[ad], self.offsets[ad + 1]
+            _, back = cv2.batchDistance(
+                des_frame[cols], self.descriptors[lo:hi], cv2.CV_32S, normType=self.engine.norm, K=1,
+            )
+            good = back[:, 0] == self.local_idx[rows]
+            rows_out.append(rows[good])
+            frame_out.append(cols[good].astype(np.int64))
+
+        if not rows_out:
+            return empty, empty
+        return np.concatenate(rows_out), np.concatenate(frame_out)
+
+    def best_match(self, des_frame, min_good=None, min_score=None, max_distance=None):
+        """Pick the ad with the highest good_matches / len(kp) score.
+
+        Returns (ad_id, score, query_idx, train_idx) or None, where query_idx are
+        keypoint indices in the ad and train_idx keypoint indices in the frame.
+        """
+        if not self.ad_ids:
+            return None
+        min_good = self.engine.min_good if min_good is None else min_good
+        min_score = self.engine.min_score if min_score is None else min_score
+
+        # An ad needs more than min_good matches to score at all
+        rows, frame_idx = self.match(des_frame, max_distance, min_votes=min_good)
+        votes = np.bincount(self.labels[rows], minlength=len(self.ad_ids))
+        scores = np.where(votes > min_good, votes / self.n_kp, 0.0)
+
+        best = int(scores.argmax())
+        score = float(scores[best])
+        if score <= min_score:
+            return None
+
+        selected = self.labels[rows] == best
+        return (
+            self.ad_ids[best],
+            score,
+            self.local_idx[rows[selected]],
+            frame_idx[selected],
+        )
+
+    def best_match_among(self, des_frame, candidate_ids, min_good=None, min_score=None, max_distance=None):
+        """best_match restricted to candidate_ids (e.g. a visual-word shortlist).
+
+        Cross-check is per ad, so each candidate gets exactly the matches it
+        would get in a full-catalog search.
+        """
+        positions = [self._position[ad_id] for ad_id in candidate_ids if ad_id in self._position]
+        if not positions:
+            return None
+        starts, ends = self.offsets[positions], self.offsets[np.asarray(positions) + 1]
+        rows = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        subset = CatalogIndex.from_packed(
+            [self.ad_ids[p] for p in positions], self.descriptors[rows], ends - starts, self.engine.name,
+        )
+        return subset.best_match(des_frame, min_good, min_score, max_distance)
+
+
+# ---------------------------
+# Cached index, rebuilt lazily when the registry changes
+# ---------------------------
+_index_lock = threading.Lock()
+_cached_index = None
+_cached_version = None
+
+
+def get_catalog_index():
+    global _cached_index, _cached_version
+    version = registry.registry_version()
+    if _cached_index is not None and _cached_version == version:
+        return _cached_index
+    with _index_lock:
+        if _cached_index is None or _cached_version != version:
+            _cached_index = CatalogIndex(dict(registry.orb_detectors))
+            _cached_version = version
+    return _cached_index
+
+
+def install_catalog_index(index, version):
+    """Use a prebuilt index for the given registry version (see shared_store)."""
+    global _cached_index, _cached_version
+    with _index_lock:
+        _cached_index = index
+        _cached_version = version
+
+
+def find_best_match(des_frame, min_score=None):
+    """best_match over the current catalog, through the visual-word shortlist
+    when it's enabled, the catalog is large enough and the vocabulary is
+    ready."""
+    index = get_catalog_index()
+    if not BOW_SHORTLIST or len(index) < SHORTLIST_MIN_ADS:
+        return index.best_match(des_frame, min_score=min_score)
+
+    word_index = get_word_index()
+    candidates = word_index.shortlist(des_frame, SHORTLIST_K)
+    if candidates is None:
+        # Vocabulary still training: match the full catalog
+        return index.best_match(des_frame, min_score=min_score)
+    # Ads added since the word index was last built are always matched
+    if word_index.version != registry.registry_version():
+        candidates = candidates + word_index.unindexed(index.ad_ids)
+    return index.best_match_among(des_frame, candidates, min_score=min_score)
@@ -0,0 +1,304 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from detection.engines import get_engine
+from detection.index import find_best_match
+from detection.protocol import decode_message
+from detection.registry import orb_detectors
+from detection.scaling import processing_scale, resize_for_processing, to_full_resolution, adapt_max_side
+from detection.settings import (
+    TRACKING_ENABLED, PROCESS_MAX_SIDE, PYRAMID_FALLBACK, PYRAMID_RETRY_FRACTION, ADAPTIVE_RESOLUTION,
+)
+from detection.tracking import start_track, track, clear_track
+from detection.roi import roi_window
+
+# Feature extractor / BFMatcher instances are not thread-safe, keep one per worker thread
+_local = threading.local()
+
+
+def _get_extractor():
+    if not hasattr(_local, "extractor"):
+        # Fewer keypoints than the markers for faster detection
+        _local.extractor = get_engine().frame_extractor()
+    return _local.extractor
+
+
+def _get_matcher():
+    if not hasattr(_local, "bf"):
+        _local.bf = get_engine().matcher()
+    return _local.bf
+
+
+def new_detection_state():
+    return {
+        "active_ad": None,
+        "active_since": None,
+        "last_position": None,
+        "detection_threshold": 3,
+        "last_seq": None,
+        "track": None,
+        # ROI scans since the last full-frame scan, and the window of this frame
+        "roi_scans": 0,
+        "roi": None,
+        "max_side": PROCESS_MAX_SIDE,
+        "avg_frame_ms": None,
+        # Per-stage timings of the last frame, read by the metrics in main
+        "stage_ms": {},
+    }
+
+
+def _add_timing(state, stage, started):
+    """Add the time since started (perf_counter) to this frame's stage timings."""
+    stage_ms = state["stage_ms"]
+    stage_ms[stage] = stage_ms.get(stage, 0.0) + (time.perf_counter() - started) * 1000
+
+
+def position_from_homography(H, corners, frame_width, frame_height):
+    """Project the marker corners (4x1x2) and return the box as % of the frame size."""
+    dst = cv2.perspectiveTransform(corners, H).reshape(-1, 2)
+
+    # Calculate bounding box
+    x_min, y_min = dst.min(axis=0)
+    x_max, y_max = dst.max(axis=0)
+
+    return {
+        "x": float((x_min / frame_width) * 100),
+        "y": float((y_min / frame_height) * 100),
+        "width": float(((x_max - x_min) / frame_width) * 100),
+        "height": float(((y_max - y_min) / frame_height) * 100),
+    }
+
+
+def process_frame(data, state):
+    """Decode one frame and run detection against the registry.
+
+    data is either a base64 string (legacy clients) or a binary frame (see
+    detection.protocol). Runs in a worker thread/process, so it only touches
+    the state dict it is given and returns it along with the result. A result
+    of None means the frame was undecodable or stale and nothing should be sent.
+    """
+    state["stage_ms"] = {}
+    decode_started = time.perf_counter()
+    try:
+        seq, gray = decode_message(data)
+    except Exception as e:
+        print(f"Error decoding image: {e}")
+        return None, state
+    finally:
+        _add_timing(state, "decode", decode_started)
+
+    # Drop frames that arrive after a newer one was already processed
+    if seq is not None:
+        if state["last_seq"] is not None and seq <= state["last_seq"]:
+            return None, state
+        state["last_seq"] = seq
+
+    scale = processing_scale(gray.shape, state["max_side"])
+    detected_ads, near_miss = _detect(gray, scale, state)
+    first_pass_ms = sum(state["stage_ms"].values())
+
+    # Small or distant markers may only be found at a higher resolution. Only
+    # retry after a near miss: most frames without a detection have no ad in
+    # view at all
+    if PYRAMID_FALLBACK and near_miss and scale < 1.0:
+        detected_ads, _ = _detect(gray, min(1.0, scale * 2), state, allow_roi=False)
+
+    # The retry runs at a fixed 2x, so only the first pass says whether max_side fits the budget
+    if ADAPTIVE_RESOLUTION and state["max_side"]:
+        adapt_max_side(state, first_pass_ms)
+    return detected_ads, state
+
+
+def _detect(full_gray, scale, state, allow_roi=True):
+    """Run tracking/detection on one frame at the given processing scale.
+
+    Features are extracted on the resized image; homographies are mapped back
+    so positions are percentages of the original frame. Returns (detected_ads,
+    near_miss), near_miss meaning the best ad scored below min_score but at
+    least PYRAMID_RETRY_FRACTION of it.
+    """
+    near_miss = False
+    outcome = _prepare(full_gray, scale, state, allow_roi)
+    if isinstance(outcome, list):
+        detected_ads = outcome
+    else:
+        match_started = time.perf_counter()
+        # Score cutoff applied here, so a near miss is visible
+        best_match = find_best_match(outcome["des"], min_score=0)
+        _add_timing(state, "match", match_started)
+        min_score = get_engine().min_score
+        if best_match is not None and best_match[1] <= min_score:
+            near_miss = best_match[1] >= PYRAMID_RETRY_FRACTION * min_score
+            best_match = None
+        homography_started = time.perf_counter()
+        detected_ads = _finish(outcome, best_match, state)
+        _add_timing(state, "homography", homography_started)
+
+    # Nothing found inside the ROI window: scan the whole frame before giving up
+    if state["roi"] is not None and not detected_ads:
+        return _detect(full_gray, scale, state, allow_roi=False)
+    return detected_ads, near_miss
+
+
+def _prepare(full_gray, scale, state, allow_roi=True):
+    """Everything up to catalog matching.
+
+    Returns the finished list of detected ads when no catalog match is needed,
+    otherwise a context dict for _finish.
+    """
+    frame_height, frame_width = full_gray.shape[:2]
+    started = time.perf_counter()
+    gray = resize_for_processing(full_gray, scale)
+
+    # Preprocess frame for better feature detection
+    gray = cv2.GaussianBlur(gray, (3, 3), 0)  # Light blur for noise reduction
+    _add_timing(state, "preprocess", started)
+
+    # Detect ads
+    detected_ads = []
+    current_state = state
+
+    # Cheap path: follow the last detection with optical flow
+    if TRACKING_ENABLED and current_state.get("track"):
+        ad_id = current_state["active_ad"]
+        detector = orb_detectors.get(ad_id)
+        started = time.perf_counter()
+        H = track(current_state, gray) if detector else None
+        _add_timing(state, "track", started)
+        if H is not None:
+            position = position_from_homography(
+                to_full_resolution(H, scale), detector.corners, frame_width, frame_height
+            )
+            current_state["active_since"] = time.time()
+            current_state["last_position"] = position
+            detected_ads.append({
+                "id": ad_id,
+                **position,
+                "videoUrl": detector.video_url,
+                "name": detector.name,
+                "status": "tracking"
+            })
+            return detected_ads
+        clear_track(current_state)
+
+    extractor = _get_extractor()
+    bf = _get_matcher()
+    started = time.perf_counter()
+    # Near the last known box only scan a window around it (crop, then shift the keypoints back)
+    roi = roi_window(current_state, gray.shape) if allow_roi else None
+    current_state["roi"] = roi
+    if roi is not None:
+        x0, y0, x1, y1 = roi
+        kp_frame, des_frame = extractor.detectAndCompute(gray[y0:y1, x0:x1], None)
+        current_state["roi_scans"] += 1
+    else:
+        kp_frame, des_frame = extractor.detectAndCompute(gray, None)
+        current_state["roi_scans"] = 0
+    _add_timing(state, "orb", started)
+
+    # If we have an active ad that was recently detected, check if it's still visible first.
+    # With tracking on this is skipped: a lost or expired track needs a full detection
+    # to get a fresh homography, not the last known position.
+    if (not TRACKING_ENABLED and
+        current_state["active_ad"] and
+        current_state["active_since"] and
+        time.time() - current_state["active_since"] < 5):  # Active for 5 seconds max
+
+        ad_id = current_state["active_ad"]
+        detector = orb_detectors.get(ad_id)
+
+        if detector and detector.des is not None and des_frame is not None:
+            # Quick check for the active ad
+            matches = bf.match(detector.des, des_frame)
+            matches = sorted(matches, key=lambda x: x.distance)
+
+            # If we still have a good match, use the last known position
+            if len(matches) > 10 and matches[0].distance < get_engine().max_distance:
+                detected_ads.append({
+                    "id": ad_id,
+                    **(current_state["last_position"] or {}),
+                    "videoUrl": detector.video_url,
+                    "name": detector.name,
+                    "status": "active"
+                })
+                return detected_ads
+
+    # If no active ad or active ad not found, check all ads
+    if des_frame is not None and len(kp_frame) > 15:
+        pts = cv2.KeyPoint_convert(kp_frame).reshape(-1, 2)
+        if roi is not None:
+            pts += np.float32([roi[0], roi[1]])
+        return {
+            "gray": gray,
+            "pts": pts,
+            "des": des_frame,
+            "scale": scale,
+            "frame_size": (frame_width, frame_height),
+        }
+
+    # If no ads detected but we have an active ad, continue tracking it
+    # (after an ROI miss the full-frame scan decides that)
+    if roi is None and current_state["active_ad"] and current_state["last_position"]:
+        ad_id = current_state["active_ad"]
+        detector = orb_detectors.get(ad_id)
+
+        if detector:
+            detected_ads.append({
+                "id": ad_id,
+                **current_state["last_position"],
+                "videoUrl": detector.video_url,
+                "name": detector.name,
+                "status": "tracking"
+            })
+
+    return detected_ads
+
+
+def _finish(ctx, best_match, state):
+    """Verify the best catalog match with a homography and build the result."""
+    detected_ads = []
+    current_state = state
+    frame_width, frame_height = ctx["frame_size"]
+    detector = orb_detectors.get(best_match[0]) if best_match else None
+
+    # Process the best match (skip it if the ad was deleted meanwhile)
+    if detector:
+        ad_id, best_match_score, query_idx, train_idx = best_match
+
+        # Gather matched coordinates with fancy indexing, no per-match Python loop
+        src_pts = detector.pts[query_idx].reshape(-1, 1, 2)
+        dst_pts = ctx["pts"][train_idx].reshape(-1, 1, 2)
+
+        try:
+            H, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+
+            if H is not None:
+                position = position_from_homography(
+                    to_full_resolution(H, ctx["scale"]), detector.corners, frame_width, frame_height
+                )
+
+                # Update detection state
+                current_state["active_ad"] = ad_id
+                current_state["active_since"] = time.time()
+                current_state["last_position"] = position
+
+                # Keep the RANSAC inliers to track in the next frames
+                if TRACKING_ENABLED and mask is not None:
+                    inliers = mask.reshape(-1).astype(bool)
+                    start_track(current_state, ctx["gray"], src_pts[inliers], dst_pts[inliers], H)
+
+                detected_ads.append({
+                    "id": ad_id,
+                    **position,
+                    "videoUrl": detector.video_url,
+                    "name": detector.name,
+                    "score": float(best_match_score),
+                    "status": "new"
+                })
+        except Exception as e:
+            print(f"Error calculating homography: {e}")
+
+    return detected_ads
@@ -0,0 +1,55 @@
+import base64
+import struct
+
+import cv2
+import numpy as np
+
+# ---------------------------
+# Binary frame protocol for /ws/detect
+#
+#   uint32 seq | uint16 width | uint16 height | JPEG bytes   (little endian)
+#
+# Text messages are still accepted as base64 JPEG for old clients.
+# ---------------------------
+FRAME_HEADER = struct.Struct("<IHH")
+
+
+class FrameDecodeError(ValueError):
+    pass
+
+
+def pack_frame(seq, width, height, jpeg_bytes):
+    return FRAME_HEADER.pack(seq & 0xFFFFFFFF, width, height) + jpeg_bytes
+
+
+def parse_binary_frame(message):
+    """Split a binary message into (seq, width, height, jpeg payload)."""
+    if len(message) <= FRAME_HEADER.size:
+        raise FrameDecodeError(f"Binary frame too short ({len(message)} bytes)")
+    seq, width, height = FRAME_HEADER.unpack_from(message)
+    return seq, width, height, memoryview(message)[FRAME_HEADER.size:]
+
+
+def decode_gray(payload):
+    # Decode straight to grayscale, no RGB/BGR intermediate copies
+    gray = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise FrameDecodeError("Could not decode image data")
+    return gray
+
+
+def decode_message(data):
+    """Decode a text (base64) or binary frame message.
+
+    Returns (seq, gray); seq is None for base64 frames, which carry no header.
+    """
+    if isinstance(data, str):
+        return None, decode_gray(base64.b64decode(data))
+
+    seq, width, height, payload = parse_binary_frame(data)
+    gray = decode_gray(payload)
+    if (width, height) != (0, 0) and gray.shape[:2] != (height, width):
+        raise FrameDecodeError(
+            f"Frame {seq} is {gray.shape[1]}x{gray.shape[0]}, header says {width}x{height}"
+        )
+    return seq, gray
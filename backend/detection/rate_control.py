@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+
+from detection.settings import (
+    LATENCY_BUDGET_MS, MIN_PROCESS_SIDE,
+    RATE_TARGET_UTILIZATION, CLIENT_MAX_FPS, CLIENT_FULL_FPS, CLIENT_MIN_FPS,
+    CLIENT_MAX_QUALITY, CLIENT_MIN_QUALITY, MAX_CONNECTIONS,
+)
+
+# ---------------------------
+# Server-driven client frame rate and admission control.
+#
+# Capacity is the number of frames per second the detection workers can
+# process, from the measured per-frame cost, scaled down when the process is
+# using more CPU than RATE_TARGET_UTILIZATION (marker jobs, renditions, ...).
+# Connections are admitted "full" while a new one can still get
+# CLIENT_FULL_FPS, then "degraded" (CLIENT_MIN_FPS, lowest resolution) while
+# there's room for that, and rejected after. Full connections split what's
+# left evenly; degraded ones are promoted as capacity frees up.
+#
+# Capacity is per process: with several uvicorn workers each one admits
+# against its own share of the machine.
+# ---------------------------
+FULL = "full"
+DEGRADED = "degraded"
+
+CPU_SAMPLE_SECONDS = 1.0
+
+
+class RateController:
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        # connection id -> {"tier", "cost_ms"}, in admission order
+        self._connections = {}
+        self._cost_ms = None
+        self._cpu_sampled = (time.monotonic(), time.process_time())
+        self._cpu = 0.0
+
+    # ---------------------------
+    # Measurements
+    # ---------------------------
+    def observe(self, connection_id, cost_ms, alpha=0.2):
+        """Record the processing time of one frame (EWMA per connection and overall)."""
+        with self._lock:
+            self._cost_ms = cost_ms if self._cost_ms is None else (1 - alpha) * self._cost_ms + alpha * cost_ms
+            connection = self._connections.get(connection_id)
+            if connection is not None:
+                last = connection["cost_ms"]
+                connection["cost_ms"] = cost_ms if last is None else (1 - alpha) * last + alpha * cost_ms
+
+    def cpu_utilization(self):
+        """Share of the machine's cores this process used since the last sample (0..1)."""
+        now, cpu = time.monotonic(), time.process_time()
+        with self._lock:
+            wall_started, cpu_started = self._cpu_sampled
+            if now - wall_started >= CPU_SAMPLE_SECONDS:
+                self._cpu = (cpu - cpu_started) / ((now - wall_started) * (os.cpu_count() or 1))
+                self._cpu_sampled = (now, cpu)
+            return self._cpu
+
+    def capacity_fps(self):
+        """Frames per second the workers can take while staying under the target utilization."""
+        cost_ms = self._cost_ms or LATENCY_BUDGET_MS
+        fps = self.workers * 1000 / max(cost_ms, 1.0) * RATE_TARGET_UTILIZATION
+        cpu = self.cpu_utilization()
+        if cpu > RATE_TARGET_UTILIZATION:
+            fps *= RATE_TARGET_UTILIZATION / cpu
+        return fps
+
+    # ---------------------------
+    # Admission
+    # ---------------------------
+    def admit(self, connection_id):
+        """Register a new connection; returns its tier, or None to reject it."""
+        capacity = self.capacity_fps()
+        with self._lock:
+            if MAX_CONNECTIONS and len(self._connections) >= MAX_CONNECTIONS:
+                return None
+            spare = capacity - self._committed_fps()
+            if spare >= CLIENT_FULL_FPS:
+                tier = FULL
+            elif spare >= CLIENT_MIN_FPS:
+                tier = DEGRADED
+            elif not self._connections:
+                # Always let one client in, however slow the server
+                tier = DEGRADED
+            else:
+                return None
+            self._connections[connection_id] = {"tier": tier, "cost_ms": None}
+            return tier
+
+    def release(self, connection_id):
+        with self._lock:
+            self._connections.pop(connection_id, None)
+
+    def _committed_fps(self):
+        return sum(
+            CLIENT_FULL_FPS if connection["tier"] == FULL else CLIENT_MIN_FPS
+            for connection in self._connections.values()
+        )
+
+    def _promote(self, capacity):
+        spare = capacity - self._committed_fps()
+        for connection in self._connections.values():
+            if spare < CLIENT_FULL_FPS - CLIENT_MIN_FPS:
+                break
+            if connection["tier"] == DEGRADED:
+                connection["tier"] = FULL
+                spare -= CLIENT_FULL_FPS - CLIENT_MIN_FPS
+
+    def tier_counts(self):
+        with self._lock:
+            counts = {FULL: 0, DEGRADED: 0}
+            for connection in self._connections.values():
+                counts[connection["tier"]] += 1
+            return counts
+
+    # ---------------------------
+    # Per-connection targets
+    # ---------------------------
+    def targets(self, connection_id, max_side):
+        """Control message for a connection: fps, resolution and JPEG quality to send at.
+
+        max_side is the connection's current processing size; anything larger
+        would be resized away on the server, so the client shouldn't send it.
+        """
+        capacity = self.capacity_fps()
+        with self._lock:
+            connection = self._connections.get(connection_id)
+            if connection is None:
+                return None
+            self._promote(capacity)
+            if connection["tier"] == DEGRADED:
+                fps = CLIENT_MIN_FPS
+                max_side = MIN_PROCESS_SIDE
+            else:
+                full = sum(1 for c in self._connections.values() if c["tier"] == FULL)
+                degraded = len(self._connections) - full
+                fps = (capacity - degraded * CLIENT_MIN_FPS) / max(full, 1)
+                # A connection's frames are processed one at a time, faster is just dropped
+                if connection["cost_ms"]:
+                    fps = min(fps, 1000 / connection["cost_ms"])
+                fps = min(max(fps, CLIENT_MIN_FPS), CLIENT_MAX_FPS)
+
+        # Spend less bandwidth and decode time as the rate drops
+        span = CLIENT_MAX_FPS - CLIENT_MIN_FPS
+        share = (fps - CLIENT_MIN_FPS) / span if span > 0 else 1.0
+        quality = CLIENT_MIN_QUALITY + (CLIENT_MAX_QUALITY - CLIENT_MIN_QUALITY) * share
+        return {
+            "type": "control",
+            "tier": connection["tier"],
+            "fps": round(fps, 1),
+            "maxSide": max_side or None,
+            "quality": round(quality, 2),
+        }
+
+
+def control_changed(new, last, fps_tolerance=0.5, quality_tolerance=0.05):
+    """Whether a control message differs enough from the last one sent to resend it."""
+    if last is None:
+        return True
+    return (
+        new["tier"] != last["tier"]
+        or new["maxSide"] != last["maxSide"]
+        or abs(new["fps"] - last["fps"]) > fps_tolerance
+        or abs(new["quality"] - last["quality"]) > quality_tolerance
+    )
@@ -0,0 +1,132 @@
+from collections import deque
+
+import numpy as np
+
+
+class MarkerDetector:
+    """Array-backed features of one ad marker.
+
+    pts is an Nx2 float32 array of keypoint coordinates, des the matching
+    contiguous NxD uint8 binary descriptors of the feature engine (D = 32 for
+    ORB), corners the 4x1x2 marker outline ready for cv2.perspectiveTransform.
+    Plain arrays keep the per-ad memory predictable and make the record
+    picklable for worker processes.
+    """
+
+    __slots__ = ("pts", "des", "shape", "corners", "video_url", "name")
+
+    def __init__(self, pts, des, shape, video_url, name):
+        self.pts = np.ascontiguousarray(pts, dtype=np.float32).reshape(-1, 2)
+        self.des = np.ascontiguousarray(des, dtype=np.uint8) if des is not None and len(des) else None
+        self.shape = tuple(shape)
+        h, w = self.shape[:2]
+        self.corners = np.float32([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
+        self.video_url = video_url
+        self.name = name
+
+    @classmethod
+    def from_features(cls, features, video_url, name):
+        return cls(features["pts"], features["des"], features["shape"], video_url, name)
+
+    def __len__(self):
+        return len(self.pts)
+
+    def same_as(self, other):
+        """True if other is a record with the same features, name and video."""
+        return (
+            other is not None
+            and self.shape == other.shape
+            and self.name == other.name
+            and self.video_url == other.video_url
+            and np.array_equal(self.pts, other.pts)
+            and (self.des is None) == (other.des is None)
+            and (self.des is None or np.array_equal(self.des, other.des))
+        )
+
+
+# Store marker detectors for each ad
+orb_detectors = {}
+
+# Bumped on every change so worker processes know when their copy is stale
+_registry_version = 0
+
+# (version, ad_id) of recent changes, so worker processes can catch up
+# without a full copy of the registry
+CHANGE_LOG_SIZE = 1024
+_change_log = deque(maxlen=CHANGE_LOG_SIZE)
+
+# (generation, registry version) while the registry mirrors a shared_store generation
+_shared = None
+
+
+def registry_version():
+    return _registry_version
+
+
+def _changed(ad_id):
+    global _registry_version
+    _registry_version += 1
+    _change_log.append((_registry_version, ad_id))
+
+
+def register_detector(ad_id, detector):
+    orb_detectors[ad_id] = detector
+    _changed(ad_id)
+
+
+def unregister_detector(ad_id):
+    if ad_id in orb_detectors:
+        del orb_detectors[ad_id]
+        _changed(ad_id)
+
+
+def rename_detector(ad_id, name):
+    if ad_id in orb_detectors:
+        orb_detectors[ad_id].name = name
+        _changed(ad_id)
+
+
+def changes_since(version):
+    """{ad_id: detector, or None if removed} for every ad changed after version.
+
+    Returns None when the change log doesn't reach back that far (or the
+    registry was replaced wholesale since), i.e. a full copy is needed.
+    """
+    if version == _registry_version:
+        return {}
+    if not _change_log or _change_log[0][0] > version + 1:
+        return None
+    changed = {ad_id for v, ad_id in _change_log if v > version}
+    return {ad_id: orb_detectors.get(ad_id) for ad_id in changed}
+
+
+def mark_shared(generation):
+    """Record that the registry currently mirrors a shared_store generation."""
+    global _shared
+    _shared = (generation, _registry_version)
+
+
+def shared_generation():
+    """Generation the registry mirrors, or None if it changed locally since."""
+    if _shared is not None and _shared[1] == _registry_version:
+        return _shared[0]
+    return None
+
+
+# ---------------------------
+# Snapshot helpers for worker processes
+# ---------------------------
+def snapshot_registry():
+    """Picklable registry copy, or ("shared", generation) when workers can map it."""
+    generation = shared_generation()
+    if generation is not None:
+        return ("shared", generation)
+    return dict(orb_detectors)
+
+
+def load_snapshot(snapshot):
+    global _registry_version
+    orb_detectors.clear()
+    orb_detectors.update(snapshot)
+    _registry_version += 1
+    _change_log.clear()
@@ -0,0 +1,90 @@
+import struct
+import time
+
+from detection.settings import RESULT_TOLERANCE, RESULT_HEARTBEAT_SECONDS
+
+# ---------------------------
+# Compact result stream for /ws/detect (?results=compact)
+#
+# Ad metadata goes out once per session as JSON text:
+#   {"type": "ads", "ads": [{"index", "id", "name", "videoUrl"}, ...]}
+# Results are binary and only sent when they change beyond RESULT_TOLERANCE:
+#   uint8 kind=1 | uint8 count | count x (uint16 ad index | uint8 status |
+#                                         int16 x, y | uint16 width, height)
+# with the box in hundredths of a percent of the frame (10000 = the whole
+# frame). x/y are signed so boxes partly off-screen keep their position. While
+# nothing changes a 1-byte heartbeat (kind=2) goes out every
+# RESULT_HEARTBEAT_SECONDS. All values little endian.
+# ---------------------------
+KIND_RESULT = 1
+KIND_HEARTBEAT = 2
+
+RESULT_HEADER = struct.Struct("<BB")
+RESULT_ENTRY = struct.Struct("<HBhhHH")
+HEARTBEAT = bytes([KIND_HEARTBEAT])
+
+STATUS_CODES = {"new": 1, "active": 2, "tracking": 3}
+# (field, lowest, highest) in quantized units, the range of its struct type
+BOX_FIELDS = (("x", -32768, 32767), ("y", -32768, 32767), ("width", 0, 65535), ("height", 0, 65535))
+
+
+def _quantize(value, lowest, highest):
+    return min(max(int(round(value * 100)), lowest), highest)
+
+
+class CompactResultEncoder:
+    """Per-connection state for the compact result stream."""
+
+    def __init__(self, tolerance=RESULT_TOLERANCE, heartbeat_seconds=RESULT_HEARTBEAT_SECONDS):
+        # Tolerance in percent of the frame, compared in quantized units
+        self.tolerance = int(round(tolerance * 100))
+        self.heartbeat_seconds = heartbeat_seconds
+        self._indexes = {}
+        self._last = None
+        self._last_sent = time.monotonic()
+
+    def encode(self, detected_ads):
+        """Return the messages to send for a result: dicts go out as JSON text, bytes as binary.
+
+        Usually an empty list: the result matches what the client already has.
+        """
+        messages = []
+        new_ads = [ad for ad in detected_ads if ad["id"] not in self._indexes]
+        if new_ads:
+            table = []
+            for ad in new_ads:
+                self._indexes[ad["id"]] = index = len(self._indexes)
+                table.append({"index": index, "id": ad["id"], "name": ad.get("name"), "videoUrl": ad.get("videoUrl")})
+            messages.append({"type": "ads", "ads": table})
+
+        entries = [
+            (
+                self._indexes[ad["id"]],
+                STATUS_CODES.get(ad.get("status"), 0),
+                *(_quantize(ad[field], lowest, highest) for field, lowest, highest in BOX_FIELDS),
+            )
+            for ad in detected_ads
+        ]
+
+        now = time.monotonic()
+        if self._changed(entries):
+            self._last = entries
+            payload = RESULT_HEADER.pack(KIND_RESULT, len(entries))
+            payload += b"".join(RESULT_ENTRY.pack(*entry) for entry in entries)
+            messages.append(payload)
+            self._last_sent = now
+        elif now - self._last_sent >= self.heartbeat_seconds:
+            messages.append(HEARTBEAT)
+            self._last_sent = now
+        return messages
+
+    def _changed(self, entries):
+        if self._last is None or len(entries) != len(self._last):
+            return True
+        for entry, last in zip(entries, self._last):
+            # Ad or status changed
+            if entry[:2] != last[:2]:
+                return True
+            if any(abs(a - b) > self.tolerance for a, b in zip(entry[2:], last[2:])):
+                return True
+        return False
@@ -0,0 +1,41 @@
+import time
+
+from detection.settings import (
+    ROI_EXTRACTION, ROI_EXPAND, ROI_FULL_SCAN_INTERVAL, ROI_MAX_AGE_SECONDS, ROI_MAX_AREA,
+)
+
+# Smallest window worth running ORB on (it ignores a ~31px border)
+MIN_ROI_SIDE = 96
+
+
+def roi_window(state, shape):
+    """Pixel window (x0, y0, x1, y1) around the last detected box, or None.
+
+    shape is the processed frame's; the last position is stored as percentages
+    so it maps onto any processing resolution. None means scan the full frame:
+    no recent position, a periodic full scan is due, or the window would be
+    too large (or too small) to be worth cropping.
+    """
+    position = state.get("last_position")
+    if (
+        not ROI_EXTRACTION
+        or not position
+        or not state.get("active_since")
+        or time.time() - state["active_since"] > ROI_MAX_AGE_SECONDS
+        or state.get("roi_scans", 0) >= ROI_FULL_SCAN_INTERVAL
+    ):
+        return None
+
+    h, w = shape[:2]
+    box_w = position["width"] / 100 * w
+    box_h = position["height"] / 100 * h
+    x0 = max(0, int(position["x"] / 100 * w - ROI_EXPAND * box_w))
+    y0 = max(0, int(position["y"] / 100 * h - ROI_EXPAND * box_h))
+    x1 = min(w, int((position["x"] + position["width"]) / 100 * w + ROI_EXPAND * box_w) + 1)
+    y1 = min(h, int((position["y"] + position["height"]) / 100 * h + ROI_EXPAND * box_h) + 1)
+
+    if x1 - x0 < MIN_ROI_SIDE or y1 - y0 < MIN_ROI_SIDE:
+        return None
+    if (x1 - x0) * (y1 - y0) > ROI_MAX_AREA * w * h:
+        return None
+    return x0, y0, x1, y1
@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+
+from detection.settings import (
+    LATENCY_BUDGET_MS, MIN_PROCESS_SIDE, MAX_PROCESS_SIDE,
+)
+
+
+def processing_scale(shape, max_side):
+    """Scale factor (<= 1) that brings the long side of shape down to max_side."""
+    long_side = max(shape[:2])
+    if not max_side or long_side <= max_side:
+        return 1.0
+    return max_side / long_side
+
+
+def resize_for_processing(gray, scale):
+    if scale >= 1.0:
+        return gray
+    h, w = gray.shape[:2]
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+
+def to_full_resolution(H, scale):
+    """Map a marker->processed-frame homography to marker->original-frame."""
+    if scale == 1.0:
+        return H
+    return np.diag([1.0 / scale, 1.0 / scale, 1.0]) @ H
+
+
+def adapt_max_side(state, elapsed_ms, alpha=0.2):
+    """Nudge the connection's processing size towards LATENCY_BUDGET_MS.
+
+    Uses an EWMA of the frame time so a single slow frame doesn't shrink it.
+    """
+    avg = state.get("avg_frame_ms")
+    avg = elapsed_ms if avg is None else (1 - alpha) * avg + alpha * elapsed_ms
+    state["avg_frame_ms"] = avg
+
+    max_side = state["max_side"]
+    if avg > LATENCY_BUDGET_MS * 1.1:
+        max_side = max(MIN_PROCESS_SIDE, int(max_side * 0.85))
+    elif avg < LATENCY_BUDGET_MS * 0.6:
+        max_side = min(MAX_PROCESS_SIDE, int(max_side * 1.1))
+    state["max_side"] = max_side
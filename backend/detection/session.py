@@ -0,0 +1,30 @@
+import asyncio
+
+
+class LatestFrameSlot:
+    """Single-item mailbox: putting a frame replaces any frame not yet taken.
+
+    The receiver never waits on the processor, so a slow detection step drops
+    stale frames instead of building a backlog.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, frame):
+        """Store frame, returning True if it replaced one that was never processed."""
+        replaced = self._frame is not None
+        if replaced:
+            self.dropped += 1
+        self._frame = frame
+        self._ready.set()
+        return replaced
+
+    async def get(self):
+        await self._ready.wait()
+        frame = self._frame
+        self._frame = None
+        self._ready.clear()
+        return frame
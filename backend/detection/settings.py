@@ -0,0 +1,141 @@
+import os
+
+# ------------------------------
+# Detection execution
+# ------------------------------
+# "inline"  -> run on the event loop (old behaviour, single core)
+# "thread"  -> ThreadPoolExecutor (OpenCV releases the GIL for the heavy calls)
+# "process" -> ProcessPoolExecutor (detector registry is copied into each worker)
+DETECTION_EXECUTOR = os.environ.get("DETECTION_EXECUTOR", "thread")
+DETECTION_WORKERS = int(os.environ.get("DETECTION_WORKERS", os.cpu_count() or 1))
+
+# ------------------------------
+# Marker features
+# ------------------------------
+MARKER_SIZE = int(os.environ.get("MARKER_SIZE", 500))
+# Feature engine (detector + descriptor + matching thresholds), see detection.engines
+FEATURE_ENGINE = os.environ.get("FEATURE_ENGINE", "orb")
+# Keypoints per marker / per camera frame for the "orb" engine
+MARKER_FEATURES = int(os.environ.get("MARKER_FEATURES", 1000))
+FRAME_FEATURES = int(os.environ.get("FRAME_FEATURES", 800))
+# On-disk cache of marker keypoints/descriptors (.npz, keyed by image hash)
+FEATURE_STORE_DIR = os.environ.get("FEATURE_STORE_DIR", "feature_cache")
+FEATURE_LOAD_WORKERS = int(os.environ.get("FEATURE_LOAD_WORKERS", os.cpu_count() or 1))
+
+# ------------------------------
+# KLT tracking between full detections
+# ------------------------------
+TRACKING_ENABLED = os.environ.get("TRACKING_ENABLED", "1") == "1"
+# Force a full ORB re-detection every N tracked frames
+REDETECT_INTERVAL = int(os.environ.get("REDETECT_INTERVAL", 15))
+# Drop the track when fewer points than this survive
+TRACK_MIN_POINTS = int(os.environ.get("TRACK_MIN_POINTS", 12))
+
+# ------------------------------
+# Processing resolution
+# ------------------------------
+# Frames are resized so their long side is at most this before ORB (0 = off)
+PROCESS_MAX_SIDE = int(os.environ.get("PROCESS_MAX_SIDE", 640))
+# Retry a missed detection one pyramid level up (2x) before giving up, but only
+# when the best ad scored at least PYRAMID_RETRY_FRACTION of the engine's
+# min_score: frames without an ad in view stay single-pass. Measured with
+# benchmarks/detection_bench.py --ads 10 --frames 60 (1280x720 frames, ORB):
+#   20% frames without an ad   p50 ms  mean ms  recall
+#     640 + gated retry           122      154   0.362
+#     640, no retry               100      100   0.149
+#     full resolution             130      132   0.362
+#     640 + retry on every miss   190        -   0.362
+#   80% frames without an ad
+#     640 + gated retry            98      103   0.444
+#     640, no retry               100       97   0.111
+#     full resolution             131      132   0.556
+PYRAMID_FALLBACK = os.environ.get("PYRAMID_FALLBACK", "1") == "1"
+PYRAMID_RETRY_FRACTION = float(os.environ.get("PYRAMID_RETRY_FRACTION", 0.3))
+# Adapt the per-connection max side to hold this per-frame budget
+ADAPTIVE_RESOLUTION = os.environ.get("ADAPTIVE_RESOLUTION", "1") == "1"
+LATENCY_BUDGET_MS = float(os.environ.get("LATENCY_BUDGET_MS", 60))
+MIN_PROCESS_SIDE = int(os.environ.get("MIN_PROCESS_SIDE", 320))
+MAX_PROCESS_SIDE = int(os.environ.get("MAX_PROCESS_SIDE", 1280))
+
+# ------------------------------
+# Shared descriptor store (one copy for all uvicorn workers)
+# ------------------------------
+SHARED_STORE = os.environ.get("SHARED_STORE", "0") == "1"
+# One store per feature engine, descriptors of different engines don't mix
+SHARED_STORE_DIR = os.environ.get("SHARED_STORE_DIR", os.path.join(FEATURE_STORE_DIR, "shared", FEATURE_ENGINE))
+# How often workers check for a newer catalog generation
+SHARED_STORE_POLL_SECONDS = float(os.environ.get("SHARED_STORE_POLL_SECONDS", 1.0))
+
+# ------------------------------
+# Registry sync across processes / replicas
+# ------------------------------
+# "file"  -> append-only event log in SYNC_DIR (workers on one host)
+# "mongo" -> MongoDB change stream on the ads collection (all replicas)
+# "none"  -> local process only
+REGISTRY_SYNC = os.environ.get("REGISTRY_SYNC", "file")
+SYNC_DIR = os.environ.get("SYNC_DIR", os.path.join(FEATURE_STORE_DIR, "sync"))
+SYNC_POLL_SECONDS = float(os.environ.get("SYNC_POLL_SECONDS", 0.2))
+# The event log is truncated once it grows past this
+SYNC_MAX_BYTES = int(os.environ.get("SYNC_MAX_BYTES", 10 * 1024 * 1024))
+
+# ------------------------------
+# Visual-word shortlist ahead of descriptor matching
+# ------------------------------
+# Score frames against an inverted file of visual words (TF-IDF) and only match
+# descriptors of the top SHORTLIST_K ads of catalogs of SHORTLIST_MIN_ADS or
+# more; smaller catalogs are matched in full. Off by default: on the synthetic
+# markers of benchmarks/shortlist_check.py the true ad is in the top 20 for only
+# 73% of frames at 200 ads and 47% at 1000, so no catalog size has been measured
+# where recall holds. Enable it with the smallest size (and K) at which
+# shortlist_check shows acceptable recall on your own markers.
+BOW_SHORTLIST = os.environ.get("BOW_SHORTLIST", "0") == "1"
+SHORTLIST_MIN_ADS = int(os.environ.get("SHORTLIST_MIN_ADS", 200))
+SHORTLIST_K = int(os.environ.get("SHORTLIST_K", 20))
+# Vocabulary tree: VOCAB_BRANCHING ** VOCAB_DEPTH words (16 ** 4 = 65536;
+# 4096 words at depth 3 cut top-20 recall at 200 ads from 73% to 40%)
+VOCAB_BRANCHING = int(os.environ.get("VOCAB_BRANCHING", 16))
+VOCAB_DEPTH = int(os.environ.get("VOCAB_DEPTH", 4))
+VOCAB_SAMPLE = int(os.environ.get("VOCAB_SAMPLE", 100_000))
+VOCAB_ITERATIONS = int(os.environ.get("VOCAB_ITERATIONS", 6))
+# Retrain once this fraction of the catalog changed since the last training
+VOCAB_RETRAIN_FRACTION = float(os.environ.get("VOCAB_RETRAIN_FRACTION", 0.5))
+VOCAB_PATH = os.environ.get("VOCAB_PATH", os.path.join(FEATURE_STORE_DIR, f"vocabulary-{FEATURE_ENGINE}.npz"))
+
+# ------------------------------
+# Compact result stream (/ws/detect?results=compact)
+# ------------------------------
+# Resend a box only once an edge moved more than this (percent of the frame)
+RESULT_TOLERANCE = float(os.environ.get("RESULT_TOLERANCE", 0.5))
+RESULT_HEARTBEAT_SECONDS = float(os.environ.get("RESULT_HEARTBEAT_SECONDS", 1.0))
+
+# ------------------------------
+# ROI-constrained feature extraction
+# ------------------------------
+# Run ORB only in a window around the last detected box, full frame on a miss
+ROI_EXTRACTION = os.environ.get("ROI_EXTRACTION", "1") == "1"
+# Window = last box grown by this fraction of its size on every side
+ROI_EXPAND = float(os.environ.get("ROI_EXPAND", 0.5))
+# Force a full-frame scan after this many ROI scans in a row
+ROI_FULL_SCAN_INTERVAL = int(os.environ.get("ROI_FULL_SCAN_INTERVAL", 10))
+# Only trust a last position this recent
+ROI_MAX_AGE_SECONDS = float(os.environ.get("ROI_MAX_AGE_SECONDS", 2.0))
+# Not worth cropping when the window covers more than this fraction of the frame
+ROI_MAX_AREA = float(os.environ.get("ROI_MAX_AREA", 0.6))
+
+# ------------------------------
+# Client rate control and admission (/ws/detect control messages)
+# ------------------------------
+RATE_CONTROL = os.environ.get("RATE_CONTROL", "1") == "1"
+# Share of the detection workers' capacity handed out to clients
+RATE_TARGET_UTILIZATION = float(os.environ.get("RATE_TARGET_UTILIZATION", 0.8))
+# Frame rates a client may be told to send at; a full-tier connection is
+# guaranteed CLIENT_FULL_FPS, a degraded one gets CLIENT_MIN_FPS
+CLIENT_MAX_FPS = float(os.environ.get("CLIENT_MAX_FPS", 10))
+CLIENT_FULL_FPS = float(os.environ.get("CLIENT_FULL_FPS", 5))
+CLIENT_MIN_FPS = float(os.environ.get("CLIENT_MIN_FPS", 2))
+CLIENT_MAX_QUALITY = float(os.environ.get("CLIENT_MAX_QUALITY", 0.7))
+CLIENT_MIN_QUALITY = float(os.environ.get("CLIENT_MIN_QUALITY", 0.5))
+# Hard cap on connections per process regardless of measured capacity (0 = none)
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", 0))
+# Seconds a rejected client is asked to wait before reconnecting
+ADMISSION_RETRY_SECONDS = float(os.environ.get("ADMISSION_RETRY_SECONDS", 10))
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+import numpy as np
+
+from detection import registry
+from detection.engines import get_engine
+from detection.index import CatalogIndex, install_catalog_index
+from detection.registry import MarkerDetector
+from detection.settings import SHARED_STORE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows: the shared store is not available
+    fcntl = None
+
+# ---------------------------
+# Memory-mapped descriptor store shared by all worker processes.
+#
+# Each generation is three files in SHARED_STORE_DIR:
+#   catalog-<gen>-des.npy   all descriptors, rows grouped by ad (uint8, M x descriptor bytes)
+#   catalog-<gen>-pts.npy   matching keypoint coordinates (float32, Mx2)
+#   catalog-<gen>.json      ad ids, row counts, shapes, names, video urls
+# and CURRENT holds the latest generation number. Workers map the .npy files
+# copy-on-write, so the pages are shared through the OS page cache.
+# ---------------------------
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "catalog.lock"
+KEEP_GENERATIONS = 2
+
+# Generation this process currently has mapped
+_attached_generation = None
+
+# update_catalog() calls waiting to be applied, and the lock of the thread applying them
+_pending_updates = []
+_pending_lock = threading.Lock()
+_writer_lock = threading.Lock()
+
+
+def _path(name):
+    return os.path.join(SHARED_STORE_DIR, name)
+
+
+@contextmanager
+def catalog_lock():
+    """Exclusive cross-process lock for building/publishing a generation."""
+    if fcntl is None:
+        raise RuntimeError("SHARED_STORE needs fcntl (Linux/macOS)")
+    os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+    with open(_path(LOCK_FILE), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@asynccontextmanager
+async def catalog_lock_async():
+    """catalog_lock for async code: waits for the lock in a thread."""
+    if fcntl is None:
+        raise RuntimeError("SHARED_STORE needs fcntl (Linux/macOS)")
+    os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+    with open(_path(LOCK_FILE), "a+") as f:
+        await asyncio.to_thread(fcntl.flock, f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def current_generation():
+    try:
+        with open(_path(CURRENT_FILE)) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def read_manifest(generation):
+    with open(_path(f"catalog-{generation}.json")) as f:
+        return json.load(f)
+
+
+def _write_atomic(path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=SHARED_STORE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def publish(detectors):
+    """Write detectors as a new generation and make it CURRENT.
+
+    Call with catalog_lock() held. Returns the new generation number.
+    """
+    os.makedirs(SHARED_STORE_DIR, exist_ok=True)
+    generation = (current_generation() or 0) + 1
+
+    ad_ids = list(detectors)
+    sizes = [len(detectors[ad_id].des) if detectors[ad_id].des is not None else 0 for ad_id in ad_ids]
+    des = [detectors[ad_id].des for ad_id, size in zip(ad_ids, sizes) if size]
+    pts = [detectors[ad_id].pts[:size] for ad_id, size in zip(ad_ids, sizes) if size]
+    manifest = {
+        "generation": generation,
+        "ad_ids": ad_ids,
+        "sizes": sizes,
+        "shapes": [list(detectors[ad_id].shape) for ad_id in ad_ids],
+        "names": [detectors[ad_id].name for ad_id in ad_ids],
+        "video_urls": [detectors[ad_id].video_url for ad_id in ad_ids],
+    }
+
+    des = np.vstack(des) if des else np.empty((0, get_engine().descriptor_bytes), dtype=np.uint8)
+    pts = np.vstack(pts) if pts else np.empty((0, 2), dtype=np.float32)
+    _write_atomic(_path(f"catalog-{generation}-des.npy"), lambda f: np.save(f, des))
+    _write_atomic(_path(f"catalog-{generation}-pts.npy"), lambda f: np.save(f, pts.astype(np.float32)))
+    _write_atomic(_path(f"catalog-{generation}.json"), lambda f: f.write(json.dumps(manifest).encode()))
+    _write_atomic(_path(CURRENT_FILE), lambda f: f.write(str(generation).encode()))
+
+    # Old generations can go; processes that still map them keep the inode alive
+    for old in range(generation - KEEP_GENERATIONS, 0, -1):
+        removed = False
+        for suffix in ("-des.npy", "-pts.npy", ".json"):
+            path = _path(f"catalog-{old}{suffix}")
+            if os.path.exists(path):
+                os.remove(path)
+                removed = True
+        if not removed:
+            break
+
+    print(f"Published shared catalog generation {generation} ({len(ad_ids)} ads, {len(des)} descriptors)")
+    return generation
+
+
+def map_generation(generation):
+    """Map a generation read-only-in-practice and return ({ad_id: MarkerDetector}, index)."""
+    manifest = read_manifest(generation)
+    # Copy-on-write maps: writeable arrays for OpenCV, pages still shared
+    des = np.load(_path(f"catalog-{generation}-des.npy"), mmap_mode="c")
+    pts = np.load(_path(f"catalog-{generation}-pts.npy"), mmap_mode="c")
+
+    detectors = {}
+    offset = 0
+    for ad_id, size, shape, name, video_url in zip(
+        manifest["ad_ids"], manifest["sizes"], manifest["shapes"],
+        manifest["names"], manifest["video_urls"],
+    ):
+        detectors[ad_id] = MarkerDetector(
+            pts[offset:offset + size], des[offset:offset + size] if size else None,
+            shape, video_url, name,
+        )
+        offset += size
+
+    ad_ids = [ad_id for ad_id, size in zip(manifest["ad_ids"], manifest["sizes"]) if size]
+    sizes = [size for size in manifest["sizes"] if size]
+    if all(size > 8 for size in sizes):
+        # Zero-copy: the index matches directly against the mapped matrix
+        index = CatalogIndex.from_packed(ad_ids, des, sizes)
+    else:
+        index = CatalogIndex(detectors)
+    return detectors, index
+
+
+def attach(generation=None):
+    """Point this process's registry at a generation (CURRENT by default)."""
+    global _attached_generation
+    if generation is None:
+        generation = current_generation()
+    if generation is None:
+        return None
+    detectors, index = map_generation(generation)
+    registry.load_snapshot(detectors)
+    install_catalog_index(index, registry.registry_version())
+    registry.mark_shared(generation)
+    _attached_generation = generation
+    return generation
+
+
+def attached_generation():
+    return _attached_generation
+
+
+def refresh():
+    """Re-attach if another process published a newer generation."""
+    generation = current_generation()
+    if generation is not None and generation != _attached_generation:
+        attach(generation)
+        print(f"Attached shared catalog generation {generation}")
+        return True
+    return False
+
+
+def update_catalog(mutate):
+    """Read-modify-write the shared catalog under the lock.
+
+    mutate receives the current {ad_id: MarkerDetector} dict and changes it in
+    place, returning True if anything changed; only then is a new generation
+    published. Calls that arrive while a generation is being written are
+    coalesced: the next writer applies all of them and publishes once. The
+    latest generation is attached if it isn't already.
+    """
+    update = {"mutate": mutate, "done": False, "generation": None, "error": None}
+    with _pending_lock:
+        _pending_updates.append(update)
+    with _writer_lock:
+        if not update["done"]:
+            with _pending_lock:
+                batch = _pending_updates[:]
+                _pending_updates.clear()
+            _apply_updates(batch)
+    if update["error"] is not None:
+        raise update["error"]
+    return update["generation"]
+
+
+def _apply_updates(batch):
+    try:
+        with catalog_lock():
+            generation = current_generation()
+            detectors = dict(map_generation(generation)[0]) if generation is not None else {}
+            changed = False
+            for update in batch:
+                try:
+                    changed = update["mutate"](detectors) or changed
+                except Exception as e:
+                    update["error"] = e
+            if changed:
+                generation = publish(detectors)
+        if generation is not None and generation != _attached_generation:
+            attach(generation)
+    except Exception as e:
+        for update in batch:
+            update["error"] = update["error"] or e
+        generation = None
+    for update in batch:
+        update["generation"] = generation
+        update["done"] = True
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import socket
+
+from detection.settings import SYNC_DIR, SYNC_POLL_SECONDS, SYNC_MAX_BYTES
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are still atomic enough for one host
+    fcntl = None
+
+# ---------------------------
+# Registry change events
+#
+#   {"op": "upsert", "ad_id", "name", "video_url", "image_path"}
+#   {"op": "rename", "ad_id", "name"}
+#   {"op": "delete", "ad_id"}
+#
+# Applying an event must be idempotent: with the change stream every process
+# also sees the changes it made itself.
+# ---------------------------
+ORIGIN = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def upsert_event(ad_id, name, video_url, image_path):
+    return {"op": "upsert", "ad_id": ad_id, "name": name, "video_url": video_url, "image_path": image_path}
+
+
+def rename_event(ad_id, name):
+    return {"op": "rename", "ad_id": ad_id, "name": name}
+
+
+def delete_event(ad_id):
+    return {"op": "delete", "ad_id": ad_id}
+
+
+class FileEventBus:
+    """Append-only JSON-lines event log shared by the workers on one host.
+
+    publish appends one line; subscribe tails the file from its current end,
+    polling its size every SYNC_POLL_SECONDS.
+    """
+
+    def __init__(self, directory=SYNC_DIR, poll_seconds=SYNC_POLL_SECONDS, max_bytes=SYNC_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "registry-events.jsonl")
+        self.poll_seconds = poll_seconds
+        self.max_bytes = max_bytes
+
+    def publish(self, event):
+        line = (json.dumps({**event, "origin": ORIGIN}) + "\n").encode()
+        with open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_size > self.max_bytes:
+                    # Readers notice the shrink and restart from the top
+                    f.truncate(0)
+                f.write(line)
+                f.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    async def subscribe(self):
+        """Yield events published by other processes from now on."""
+        offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        partial = b""
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                continue
+            if size < offset:
+                offset, partial = 0, b""
+            if size == offset:
+                continue
+
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read(size - offset)
+            offset += len(chunk)
+
+            *lines, partial = (partial + chunk).split(b"\n")
+            for line in lines:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get("origin") != ORIGIN:
+                    yield event
+
+
+def _upsert_from_document(ad_id, doc):
+    return upsert_event(
+        ad_id, doc.get("name"), doc.get("videoUrl"),
+        doc.get("imageUrl", "").replace("/static/", "static/"),
+    )
+
+
+async def watch_change_stream(collection, retry_seconds=2.0):
+    """Yield registry events from a MongoDB change stream on the ads collection.
+
+    Needs a replica set (Atlas clusters are). Resumes after errors.
+    """
+    resume_token = None
+    while True:
+        try:
+            async with collection.watch(full_document="updateLookup", resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    op = change["operationType"]
+                    ad_id = str(change["documentKey"]["_id"])
+                    doc = change.get("fullDocument")
+
+                    if op == "delete":
+                        yield delete_event(ad_id)
+                    elif not doc or doc.get("status", "ready") != "ready":
+                        # Ads join the registry once marker processing is done
+                        continue
+                    elif op in ("insert", "replace"):
+                        yield _upsert_from_document(ad_id, doc)
+                    elif op == "update":
+                        fields = change.get("updateDescription", {}).get("updatedFields", {})
+                        if "status" in fields:
+                            yield _upsert_from_document(ad_id, doc)
+                        elif "name" in fields:
+                            yield rename_event(ad_id, doc.get("name"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Change stream error, retrying in {retry_seconds}s: {e}")
+            await asyncio.sleep(retry_seconds)
@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+
+from detection.settings import REDETECT_INTERVAL, TRACK_MIN_POINTS
+
+LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01),
+)
+
+
+def clear_track(state):
+    state["track"] = None
+
+
+def start_track(state, gray, marker_pts, frame_pts, H):
+    """Remember the homography inliers of a fresh detection for KLT tracking."""
+    if len(frame_pts) < TRACK_MIN_POINTS:
+        clear_track(state)
+        return
+    state["track"] = {
+        "prev_gray": gray,
+        "marker_pts": np.float32(marker_pts).reshape(-1, 1, 2),
+        "frame_pts": np.float32(frame_pts).reshape(-1, 1, 2),
+        "H": H,
+        "frames": 0,
+    }
+
+
+def _rescale(current, shape):
+    """Move a track to another processing resolution (pyramid retry, adaptive max side)."""
+    prev_h, prev_w = current["prev_gray"].shape[:2]
+    h, w = shape[:2]
+    sx, sy = w / prev_w, h / prev_h
+    current["prev_gray"] = cv2.resize(current["prev_gray"], (w, h), interpolation=cv2.INTER_AREA)
+    current["frame_pts"] = current["frame_pts"] * np.float32([sx, sy])
+    current["H"] = np.diag([sx, sy, 1.0]) @ current["H"]
+
+
+def track(state, gray):
+    """Follow the stored points into this frame with pyramidal Lucas-Kanade.
+
+    Returns the re-estimated homography, or None when the track degraded or a
+    periodic full re-detection is due (the track is cleared in that case).
+    """
+    current = state.get("track")
+    if current is None:
+        return None
+    if current["frames"] >= REDETECT_INTERVAL:
+        clear_track(state)
+        return None
+    if current["prev_gray"].shape != gray.shape:
+        _rescale(current, gray.shape)
+
+    next_pts, status, _ = cv2.calcOpticalFlowPyrLK(
+        current["prev_gray"], gray, current["frame_pts"], None, **LK_PARAMS
+    )
+    if next_pts is None:
+        clear_track(state)
+        return None
+
+    ok = status.reshape(-1) == 1
+    if ok.sum() < TRACK_MIN_POINTS:
+        clear_track(state)
+        return None
+
+    marker_pts = current["marker_pts"][ok]
+    frame_pts = next_pts[ok]
+    H, mask = cv2.findHomography(marker_pts, frame_pts, cv2.RANSAC, 5.0)
+    if H is None:
+        clear_track(state)
+        return None
+
+    inliers = mask.reshape(-1).astype(bool)
+    if inliers.sum() < TRACK_MIN_POINTS:
+        clear_track(state)
+        return None
+
+    current["prev_gray"] = gray
+    current["marker_pts"] = marker_pts[inliers]
+    current["frame_pts"] = frame_pts[inliers]
+    current["H"] = H
+    current["frames"] += 1
+    return H
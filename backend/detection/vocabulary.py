@@ -0,0 +1,345 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+from detection import registry
+from detection.engines import get_engine
+from detection.settings import (
+    VOCAB_BRANCHING, VOCAB_DEPTH, VOCAB_SAMPLE, VOCAB_ITERATIONS,
+    VOCAB_RETRAIN_FRACTION, VOCAB_PATH,
+)
+
+
+# ---------------------------
+# Binary vocabulary tree (hierarchical k-majority over binary descriptors)
+# ---------------------------
+class VocabularyTree:
+    """Hierarchical vocabulary of binary visual words.
+
+    levels[l] holds the cluster centres of depth l as a (branching ** (l + 1))
+    x descriptor-width uint8 matrix; the children of node n at depth l are rows
+    n * branching .. (n + 1) * branching of levels[l]. Leaves are the words, so
+    quantizing a descriptor costs branching * depth Hamming distances instead
+    of one per word. norm is the feature engine's descriptor distance.
+    """
+
+    def __init__(self, levels, branching, trained_ads=0, norm=cv2.NORM_HAMMING):
+        self.levels = levels
+        self.branching = branching
+        self.depth = len(levels)
+        self.n_words = branching ** self.depth
+        self.trained_ads = trained_ads
+        self.norm = norm
+
+    @classmethod
+    def train(cls, descriptors, trained_ads, branching=VOCAB_BRANCHING, depth=VOCAB_DEPTH,
+              iterations=VOCAB_ITERATIONS, seed=0, norm=cv2.NORM_HAMMING):
+        rng = np.random.default_rng(seed)
+        width = descriptors.shape[1]
+        levels = [np.empty((branching ** (l + 1), width), dtype=np.uint8) for l in range(depth)]
+
+        # Depth first: (level, node, descriptors of that node)
+        pending = [(0, 0, descriptors)]
+        while pending:
+            level, node, data = pending.pop()
+            centres, assignment = _k_majority(data, branching, iterations, rng, norm)
+            levels[level][node * branching:(node + 1) * branching] = centres
+            if level + 1 < depth:
+                for child in range(branching):
+                    pending.append((level + 1, node * branching + child, data[assignment == child]))
+        return cls(levels, branching, trained_ads, norm)
+
+    def quantize(self, descriptors):
+        """Word id (int64) of every descriptor row."""
+        descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+        nodes = np.zeros(len(descriptors), dtype=np.int64)
+        b = self.branching
+        for centres in self.levels:
+            # Group descriptors by current node so each node is one batchDistance call
+            order = np.argsort(nodes, kind="stable")
+            unique, starts = np.unique(nodes[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            for node, start, end in zip(unique, starts, ends):
+                rows = order[start:end]
+                _, nearest = cv2.batchDistance(
+                    descriptors[rows], centres[node * b:(node + 1) * b], cv2.CV_32S,
+                    normType=self.norm, K=1,
+                )
+                nodes[rows] = node * b + nearest[:, 0]
+        return nodes
+
+    def save(self, path=VOCAB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, branching=self.branching, trained_ads=self.trained_ads,
+                         **{f"level{l}": centres for l, centres in enumerate(self.levels)})
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path=VOCAB_PATH):
+        engine = get_engine()
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                branching = int(data["branching"])
+                levels = [data[f"level{l}"] for l in range(VOCAB_DEPTH)]
+                trained_ads = int(data["trained_ads"])
+        except Exception as e:
+            print(f"Ignoring unreadable vocabulary {path}: {e}")
+            return None
+        # Trained for another branching factor or feature engine
+        if branching != VOCAB_BRANCHING or levels[0].shape[1] != engine.descriptor_bytes:
+            return None
+        return cls(levels, branching, trained_ads, engine.norm)
+
+
+def _k_majority(data, k, iterations, rng, norm):
+    """k-means for binary vectors: assignment by norm, per-bit majority centres."""
+    if len(data) <= k:
+        # Too few descriptors to split: pad with copies, extra children stay empty
+        centres = data[np.arange(k) % len(data)] if len(data) else np.zeros((k, data.shape[1]), dtype=np.uint8)
+        return centres, np.arange(len(data))
+
+    centres = data[rng.choice(len(data), k, replace=False)].copy()
+    bits = np.unpackbits(data, axis=1)
+    assignment = None
+    for _ in range(iterations):
+        _, nearest = cv2.batchDistance(data, centres, cv2.CV_32S, normType=norm, K=1)
+        new_assignment = nearest[:, 0]
+        if assignment is not None and np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+
+        # Per-cluster bit sums with one sort + reduceat
+        counts = np.bincount(assignment, minlength=k)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        order = np.argsort(assignment, kind="stable")
+        sums = np.add.reduceat(bits[order], starts, axis=0, dtype=np.int64)
+        centres[filled] = np.packbits(sums * 2 >= counts[filled, None], axis=1)
+    return centres, assignment
+
+
+# ---------------------------
+# Inverted file with TF-IDF scoring
+# ---------------------------
+def _fingerprint(detector):
+    return hashlib.blake2b(detector.des.tobytes(), digest_size=8).digest()
+
+
+class VisualWordIndex:
+    """Inverted file from visual words to ads, kept in step with the registry.
+
+    request_sync() only queues work: a background thread trains the vocabulary
+    (the first time, and again once the catalog has drifted by
+    VOCAB_RETRAIN_FRACTION), quantizes ads it hasn't seen (or whose
+    descriptors changed) and re-packs the posting arrays, then swaps them in.
+    Until the first build is ready shortlist() returns None and callers match
+    the full catalog; while a later sync is pending it answers from the
+    previous build (see unindexed()).
+    """
+
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary if vocabulary is not None else VocabularyTree.load()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pending = None
+        self._requested = None
+        # ad_id -> (detector, fingerprint, words, counts); only the worker touches it
+        self._ads = {}
+        self._changes_since_training = 0
+        # (vocabulary, ad_ids, ad id set, posting arrays...) of the last build
+        self._postings = None
+        # Registry version the last build reflects
+        self.version = None
+
+    # ---------------------------
+    # Registry sync
+    # ---------------------------
+    def request_sync(self, detectors, version):
+        """Queue a sync with the registry and return at once."""
+        with self._lock:
+            if version == self._requested:
+                return
+            self._requested = version
+            self._pending = (dict(detectors), version)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="vocabulary", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._pending is None:
+                    self._worker = None
+                    return
+                detectors, version = self._pending
+                self._pending = None
+            try:
+                self.sync(detectors, version)
+            except Exception as e:
+                print(f"Visual word index sync failed: {e}")
+
+    def sync(self, detectors, version):
+        """Bring the index in step with detectors (blocking; trains if needed)."""
+        eligible = {
+            ad_id: detector for ad_id, detector in detectors.items()
+            if detector.des is not None and len(detector) > 8
+        }
+        if not eligible:
+            self._swap({}, version)
+            return
+        if self._needs_retraining(len(eligible)):
+            self._train(eligible)
+            self._swap(self._ads, version)
+            return
+
+        # Filling an empty index (startup) isn't drift
+        initial = not self._ads
+        ads = {ad_id: entry for ad_id, entry in self._ads.items() if ad_id in eligible}
+        self._changes_since_training += len(self._ads) - len(ads)
+        for ad_id, detector in eligible.items():
+            known = ads.get(ad_id)
+            if known is not None and known[0] is detector:
+                continue
+            fingerprint = _fingerprint(detector)
+            if known is not None and known[1] == fingerprint:
+                # Same descriptors in a new record (e.g. a remapped shared catalog)
+                ads[ad_id] = (detector,) + known[1:]
+                continue
+            words, counts = np.unique(self.vocabulary.quantize(detector.des), return_counts=True)
+            ads[ad_id] = (detector, fingerprint, words, counts)
+            self._changes_since_training += known is None and not initial
+        self._swap(ads, version)
+
+    def _swap(self, ads, version):
+        """Pack the posting arrays and publish them with the version they reflect."""
+        self._ads = ads
+        postings = _pack(self.vocabulary, list(ads.items())) if ads else None
+        with self._lock:
+            self._postings = postings
+            self.version = version
+
+    def _needs_retraining(self, n_ads):
+        if self.vocabulary is None:
+            return True
+        baseline = max(self.vocabulary.trained_ads, 1)
+        drift = max(self._changes_since_training, abs(n_ads - baseline))
+        return drift > VOCAB_RETRAIN_FRACTION * baseline
+
+    def _train(self, detectors):
+        blocks = [detector.des for detector in detectors.values()]
+        descriptors = np.vstack(blocks)
+        if len(descriptors) > VOCAB_SAMPLE:
+            rows = np.random.default_rng(0).choice(len(descriptors), VOCAB_SAMPLE, replace=False)
+            descriptors = descriptors[rows]
+        print(f"Training visual vocabulary on {len(descriptors)} descriptors from {len(detectors)} ads")
+        vocabulary = VocabularyTree.train(descriptors, len(detectors), norm=get_engine().norm)
+        try:
+            vocabulary.save()
+        except OSError as e:
+            print(f"Could not save visual vocabulary: {e}")
+
+        # Quantize the whole catalog with the new words before swapping it in
+        ads = {}
+        for ad_id, detector in detectors.items():
+            words, counts = np.unique(vocabulary.quantize(detector.des), return_counts=True)
+            ads[ad_id] = (detector, _fingerprint(detector), words, counts)
+        self.vocabulary = vocabulary
+        self._ads = ads
+        self._changes_since_training = 0
+        print(f"Visual vocabulary ready ({vocabulary.n_words} words, {len(ads)} ads)")
+
+    # ---------------------------
+    # Scoring
+    # ---------------------------
+    def unindexed(self, ad_ids):
+        """The ad_ids the last build doesn't cover (added since it was packed)."""
+        with self._lock:
+            postings = self._postings
+        known = postings[2] if postings is not None else set()
+        return [ad_id for ad_id in ad_ids if ad_id not in known]
+
+    def shortlist(self, des_frame, k):
+        """Ad ids of the k best TF-IDF scores for a frame, or None if not ready."""
+        with self._lock:
+            postings = self._postings
+        if postings is None:
+            return None
+        vocabulary, ad_ids, _, offsets, post_ads, post_weights, idf = postings
+
+        words, counts = np.unique(vocabulary.quantize(des_frame), return_counts=True)
+        query = counts / counts.sum() * idf[words]
+        norm = np.sqrt(np.dot(query, query))
+        if norm == 0:
+            return []
+        query /= norm
+
+        # Gather every posting of the frame's words in one go
+        starts, ends = offsets[words], offsets[words + 1]
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return []
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        scores = np.bincount(
+            post_ads[positions],
+            weights=post_weights[positions] * np.repeat(query, lengths),
+            minlength=len(ad_ids),
+        )
+
+        k = min(k, len(ad_ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[scores[top] > 0]
+        return [ad_ids[i] for i in top[np.argsort(-scores[top])]]
+
+
+def _pack(vocabulary, items):
+    """Build the CSR posting lists and TF-IDF weights from per-ad histograms."""
+    n_words = vocabulary.n_words
+    ad_ids = [ad_id for ad_id, _ in items]
+    words = np.concatenate([entry[2] for _, entry in items])
+    counts = np.concatenate([entry[3] for _, entry in items]).astype(np.float32)
+    sizes = [len(entry[2]) for _, entry in items]
+    ads = np.repeat(np.arange(len(items), dtype=np.int32), sizes)
+
+    df = np.bincount(words, minlength=n_words)
+    idf = np.log(len(items) / np.maximum(df, 1)).astype(np.float32)
+    totals = np.bincount(ads, weights=counts, minlength=len(items))
+    weights = counts / totals[ads] * idf[words]
+    norms = np.sqrt(np.bincount(ads, weights=weights * weights, minlength=len(items)))
+    weights /= np.maximum(norms[ads], 1e-12)
+
+    order = np.argsort(words, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+    return vocabulary, ad_ids, set(ad_ids), offsets, ads[order], weights[order].astype(np.float32), idf
+
+
+# ---------------------------
+# Process-wide instance, synced in the background with the registry
+# ---------------------------
+_word_index = None
+_word_index_lock = threading.Lock()
+
+
+def get_word_index():
+    global _word_index
+    if _word_index is None:
+        with _word_index_lock:
+            if _word_index is None:
+                _word_index = VisualWordIndex()
+    version = registry.registry_version()
+    if version != _word_index.version:
+        _word_index.request_sync(registry.orb_detectors, version)
+    return _word_index
@@ -0,0 +1,54 @@
+import asyncio
+import os
+
+# ---------------------------
+# Background job queue: a fixed number of worker tasks pull jobs off an
+# asyncio queue, so slow per-ad work (marker features, later video
+# preprocessing) runs in parallel but never more than JOB_WORKERS at once.
+# ---------------------------
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", min(4, os.cpu_count() or 1)))
+
+
+class JobQueue:
+    """Bounded pool of async workers running queued coroutine functions.
+
+    Jobs handle their own success/failure bookkeeping; an exception escaping
+    a job is printed and the worker moves on.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = max(1, workers)
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker(i)) for i in range(self.workers)
+            ]
+            print(f"Started {self.workers} background job workers")
+
+    def submit(self, name, job, *args):
+        """Queue job(*args); name is only used in log lines."""
+        self._queue.put_nowait((name, job, args))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    async def _worker(self, worker_id):
+        while True:
+            name, job, args = await self._queue.get()
+            try:
+                await job(*args)
+            except Exception as e:
+                print(f"Job {name} failed on worker {worker_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def join(self):
+        await self._queue.join()
+
+    def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
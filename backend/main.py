@@ -1,21 +1,34 @@
 import os
-import cv2
-import numpy as np
 import asyncio
 import json
-from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import List, Dict, Optional
-import base64
-import io
-from PIL import Image
-import time
+from typing import List, Optional
 from bson import ObjectId
-import shutil
 from pydantic import BaseModel
+import time
+from detection.engines import get_engine
+from detection.registry import MarkerDetector, orb_detectors, register_detector, unregister_detector, rename_detector
+from detection.pipeline import new_detection_state
+from detection.executor import DetectionExecutor
+from detection.feature_store import load_many, load_or_compute
+from detection.session import LatestFrameSlot
+from detection.settings import (
+    SHARED_STORE, SHARED_STORE_POLL_SECONDS, REGISTRY_SYNC,
+    RATE_CONTROL, ADMISSION_RETRY_SECONDS,
+)
+from detection import shared_store
+from detection.result_stream import CompactResultEncoder
+from detection.rate_control import RateController, control_changed
+from detection.sync import FileEventBus, watch_change_stream, upsert_event, rename_event, delete_event
+import metrics
+from uploads import UploadLimitMiddleware, check_upload, save_upload, MAX_IMAGE_BYTES, MAX_VIDEO_BYTES
+from jobs import JobQueue
+from media import build_renditions, rendition_paths
+from catalog import catalog_cache_headers, bump_catalog_version, list_ads, iter_ad_batches, READY_QUERY, DEFAULT_PAGE_SIZE
 
 app = FastAPI()
 
@@ -25,7 +38,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Link"],
 )
+# Refuse oversized uploads before Starlette spools them
+app.add_middleware(UploadLimitMiddleware)
 # ADD HTTPS REDIRECT MIDDLEWARE FOR RENDER.COM
 if os.environ.get('RENDER'):
     app.add_middleware(HTTPSRedirectMiddleware)
@@ -44,51 +60,260 @@ ads_collection = db["ads"]
 # Store active WebSocket connections
 active_connections: List[WebSocket] = []
 
-# Store ORB detectors for each ad
-orb_detectors = {}
-
 # Track detection state for each connection
 detection_states = {}
 
+# Worker pool for the per-frame detection step
+detection_executor = DetectionExecutor()
+
+# Client frame rate / resolution targets and admission against measured capacity
+rate_controller = RateController(1 if detection_executor.mode == "inline" else detection_executor.workers) if RATE_CONTROL else None
+
+# Registry change events for other workers (REGISTRY_SYNC=file); with "mongo"
+# the change stream carries them and nothing is published here
+registry_events = FileEventBus() if REGISTRY_SYNC == "file" else None
+
+# Background workers for marker feature extraction
+job_queue = JobQueue()
+
+# Seconds between processed/dropped counters sent to each client
+STATS_INTERVAL = 1.0
+
+# Per-connection fps/dropped counters for /metrics
+connection_stats = {}
+
+metrics.Gauge("detection_active_connections", "Open /ws/detect connections",
+              lambda: len(active_connections))
+metrics.Gauge("detection_registry_size", "Ads in the detector registry",
+              lambda: len(orb_detectors))
+metrics.Gauge("detection_feature_engine", "Feature engine in use (extraction cost is the orb stage)",
+              lambda: [({"engine": get_engine().name}, 1)])
+metrics.Gauge("detection_connection_fps", "Processed frames per second per connection",
+              lambda: [({"connection": cid}, round(stats["fps"], 2)) for cid, stats in list(connection_stats.items())])
+metrics.Gauge("detection_connection_dropped_frames", "Frames dropped per connection",
+              lambda: [({"connection": cid}, stats["dropped"]) for cid, stats in list(connection_stats.items())])
+if rate_controller is not None:
+    metrics.Gauge("detection_connection_tiers", "Open /ws/detect connections by admission tier",
+                  lambda: [({"tier": tier}, count) for tier, count in rate_controller.tier_counts().items()])
+    metrics.Gauge("detection_capacity_fps", "Estimated frames per second the detection workers can take",
+                  lambda: round(rate_controller.capacity_fps(), 2))
+
 # Pydantic model for ad update
 class AdUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
 
+# Load marker features for a list of ad documents
+async def load_detectors(ads):
+    ads = [ad for ad in ads if os.path.exists(ad["imageUrl"].replace("/static/", "static/"))]
+    
+    # Features come from the on-disk store, only new/changed images are recomputed
+    image_paths = [ad["imageUrl"].replace("/static/", "static/") for ad in ads]
+    all_features = await load_many(image_paths)
+    
+    return {
+        str(ad["_id"]): MarkerDetector.from_features(features, ad["videoUrl"], ad["name"])
+        for ad, features in zip(ads, all_features)
+        if features is not None
+    }
+
 # Initialize ORB detectors for existing ads
 async def initialize_orb_detectors():
-    ads = await ads_collection.find({}).to_list(1000)
-    for ad in ads:
-        ad_id = str(ad["_id"])
-        image_path = ad["imageUrl"].replace("/static/", "static/")
-        
-        if os.path.exists(image_path):
-            marker = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-            if marker is not None:
-                # Resize image to standard size for consistent feature detection
-                marker = cv2.resize(marker, (500, 500))
-                orb = cv2.ORB_create(1000)  # Reduced features for faster detection
-                kp_marker, des_marker = orb.detectAndCompute(marker, None)
-                orb_detectors[ad_id] = {
-                    "kp": kp_marker,
-                    "des": des_marker,
-                    "shape": marker.shape,
-                    "video_url": ad["videoUrl"],
-                    "name": ad["name"]
-                }
-                print(f"Initialized detector for ad {ad_id} with {len(kp_marker)} features")
+    # Ads whose job didn't finish before a restart get queued again
+    unfinished = {"$or": [{"status": "processing"}, {"videoStatus": "processing"}]}
+    async for batch in iter_ad_batches(ads_collection, unfinished):
+        for ad in batch:
+            if ad.get("status") == "processing":
+                submit_marker_job(str(ad["_id"]), ad["name"], ad["videoUrl"], ad["imageUrl"].replace("/static/", "static/"))
+            if ad.get("videoStatus") == "processing":
+                submit_video_job(str(ad["_id"]), ad["videoUrl"].replace("/static/", "static/"))
+    
+    # Ready ads are streamed in batches instead of loading the whole catalog at once
+    projection = {"name": 1, "imageUrl": 1, "videoUrl": 1}
+    
+    if SHARED_STORE:
+        # First worker to get the lock builds the shared catalog, the others just map it
+        async with shared_store.catalog_lock_async():
+            generation = shared_store.current_generation()
+            ad_ids = {str(ad_id) for ad_id in await ads_collection.distinct("_id", READY_QUERY)}
+            if generation is None or set(shared_store.read_manifest(generation)["ad_ids"]) != ad_ids:
+                detectors = {}
+                async for batch in iter_ad_batches(ads_collection, READY_QUERY, projection):
+                    detectors.update(await load_detectors(batch))
+                generation = shared_store.publish(detectors)
+        shared_store.attach(generation)
+    else:
+        async for batch in iter_ad_batches(ads_collection, READY_QUERY, projection):
+            for ad_id, detector in (await load_detectors(batch)).items():
+                register_detector(ad_id, detector)
+    print(f"Initialized detectors for {len(orb_detectors)} ads")
+
+# ---------------------------
+# Registry changes (local dict or shared catalog), all idempotent
+# ---------------------------
+async def registry_add(ad_id, detector):
+    if SHARED_STORE:
+        def add(d):
+            # Replayed events must not publish a new generation for nothing
+            if detector.same_as(d.get(ad_id)):
+                return False
+            d[ad_id] = detector
+            return True
+        await asyncio.to_thread(shared_store.update_catalog, add)
+    elif not detector.same_as(orb_detectors.get(ad_id)):
+        register_detector(ad_id, detector)
+
+async def registry_rename(ad_id, name):
+    if SHARED_STORE:
+        def rename(d):
+            if ad_id not in d or d[ad_id].name == name:
+                return False
+            d[ad_id].name = name
+            return True
+        await asyncio.to_thread(shared_store.update_catalog, rename)
+    elif ad_id in orb_detectors and orb_detectors[ad_id].name != name:
+        rename_detector(ad_id, name)
+
+async def registry_remove(ad_id):
+    if SHARED_STORE:
+        await asyncio.to_thread(shared_store.update_catalog, lambda d: d.pop(ad_id, None) is not None)
+    else:
+        unregister_detector(ad_id)
+
+# Apply an add/rename/delete made by another process or replica
+async def apply_registry_event(event):
+    ad_id = event["ad_id"]
+    if event["op"] == "delete":
+        await registry_remove(ad_id)
+    elif event["op"] == "rename":
+        await registry_rename(ad_id, event["name"])
+    elif event["op"] == "upsert":
+        if ad_id in orb_detectors:
+            await registry_rename(ad_id, event["name"])
+            return
+        image_path = event.get("image_path")
+        if not image_path or not os.path.exists(image_path):
+            print(f"Sync: no marker image for ad {ad_id} on this host")
+            return
+        # Normally a feature store hit, the publishing process already computed them
+        features, _ = await asyncio.to_thread(load_or_compute, image_path)
+        if features is not None:
+            await registry_add(ad_id, MarkerDetector.from_features(features, event["video_url"], event["name"]))
+    print(f"Sync: applied {event['op']} for ad {ad_id}")
+
+async def sync_registry():
+    events = registry_events.subscribe() if registry_events is not None else watch_change_stream(ads_collection)
+    async for event in events:
+        try:
+            await apply_registry_event(event)
+        except Exception as e:
+            print(f"Error applying registry event {event}: {e}")
+
+# ---------------------------
+# Background marker processing
+# ---------------------------
+async def process_marker_job(ad_id, name, video_url, image_path):
+    try:
+        features, cached = await asyncio.to_thread(load_or_compute, image_path)
+        if features is None:
+            raise ValueError("marker image could not be decoded")
+    except Exception as e:
+        await ads_collection.update_one(
+            {"_id": ObjectId(ad_id)}, {"$set": {"status": "failed", "error": str(e)}}
+        )
+        await bump_catalog_version(db)
+        print(f"Marker processing failed for ad {ad_id}: {e}")
+        return
+
+    result = await ads_collection.update_one(
+        {"_id": ObjectId(ad_id)},
+        {"$set": {"status": "ready", "featureCount": len(features["pts"])}, "$unset": {"error": ""}},
+    )
+    await bump_catalog_version(db)
+    if result.matched_count == 0:
+        # Deleted while it was being processed
+        return
+
+    # Only ready ads join the live detection index
+    await registry_add(ad_id, MarkerDetector.from_features(features, video_url, name))
+    if registry_events is not None:
+        registry_events.publish(upsert_event(ad_id, name, video_url, image_path))
+    print(f"Initialized detector for ad {ad_id} with {len(features['pts'])} features"
+          f"{' (cached)' if cached else ''}")
+
+def submit_marker_job(ad_id, name, video_url, image_path):
+    job_queue.submit(f"marker:{ad_id}", process_marker_job, ad_id, name, video_url, image_path)
+
+# Smaller renditions, poster and preview clip so clients can start the overlay sooner
+async def process_video_job(ad_id, video_path):
+    try:
+        renditions = await asyncio.to_thread(build_renditions, video_path)
+    except Exception as e:
+        await ads_collection.update_one(
+            {"_id": ObjectId(ad_id)}, {"$set": {"videoStatus": "failed", "videoError": str(e)}}
+        )
+        await bump_catalog_version(db)
+        print(f"Video processing failed for ad {ad_id}: {e}")
+        return
+
+    result = await ads_collection.update_one(
+        {"_id": ObjectId(ad_id)}, {"$set": {"videoStatus": "ready", **renditions}}
+    )
+    await bump_catalog_version(db)
+    if result.matched_count == 0:
+        # Deleted while it was being processed
+        for path in rendition_paths(renditions):
+            if os.path.exists(path):
+                os.remove(path)
+        return
+    print(f"Built {len(renditions['renditions'])} renditions for ad {ad_id}")
+
+def submit_video_job(ad_id, video_path):
+    job_queue.submit(f"video:{ad_id}", process_video_job, ad_id, video_path)
+
+# Pick up catalog generations published by other workers
+async def watch_shared_catalog():
+    while True:
+        await asyncio.sleep(SHARED_STORE_POLL_SECONDS)
+        try:
+            await asyncio.to_thread(shared_store.refresh)
+        except Exception as e:
+            print(f"Error refreshing shared catalog: {e}")
 
 @app.on_event("startup")
 async def startup_event():
+    # Fails fast on an unknown FEATURE_ENGINE
+    print(f"Feature engine: {get_engine().name}")
+    job_queue.start()
     await initialize_orb_detectors()
+    if SHARED_STORE:
+        asyncio.create_task(watch_shared_catalog())
+    if REGISTRY_SYNC in ("file", "mongo"):
+        asyncio.create_task(sync_registry())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    detection_executor.shutdown()
+    job_queue.shutdown()
 
 # GET all ads
+# Paginated with ?after=<last _id>&limit=N, the next cursor comes back in
+# X-Next-Cursor / Link. ?fields=name,videoUrl limits the returned fields.
 @app.get("/api/ads")
-async def get_ads():
-    ads = await ads_collection.find({}).to_list(1000)
-    for ad in ads:
-        ad["_id"] = str(ad["_id"])
-    return ads
+async def get_ads(request: Request, after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, fields: Optional[str] = None):
+    headers, not_modified = await catalog_cache_headers(db, request)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        ads, next_cursor = await list_ads(ads_collection, after, limit, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(after=next_cursor)}>; rel="next"'
+    return JSONResponse(ads, headers=headers)
 
 # GET single ad
 @app.get("/api/ads/{ad_id}")
@@ -111,47 +336,75 @@ async def create_ad(
     image: UploadFile = File(...),
     video: UploadFile = File(...),
 ):
-    # Save image
-    image_path = os.path.join("static/images", image.filename)
-    with open(image_path, "wb") as f:
-        f.write(await image.read())
-    image_url = f"/static/images/{image.filename}"
-
-    # Save video
-    video_path = os.path.join("static/videos", video.filename)
-    with open(video_path, "wb") as f:
-        f.write(await video.read())
-    video_url = f"/static/videos/{video.filename}"
-
-    # Insert into MongoDB
-    doc = {
-        "name": name,
-        "description": description,
-        "imageUrl": image_url,
-        "videoUrl": video_url,
-    }
-    result = await ads_collection.insert_one(doc)
+    # Check both files before storing either
+    check_upload(image, "image")
+    check_upload(video, "video")
+
+    # Save image and video, streamed in chunks so large uploads don't sit in memory
+    image_filename = os.path.basename(image.filename)
+    image_path = os.path.join("static/images", image_filename)
+    image_size, image_sha256 = await save_upload(image, image_path, MAX_IMAGE_BYTES)
+    image_url = f"/static/images/{image_filename}"
+
+    video_filename = os.path.basename(video.filename)
+    video_path = os.path.join("static/videos", video_filename)
+    stored = [image_path]
+    try:
+        video_size, video_sha256 = await save_upload(video, video_path, MAX_VIDEO_BYTES)
+        stored.append(video_path)
+        video_url = f"/static/videos/{video_filename}"
+
+        # Insert into MongoDB
+        doc = {
+            "name": name,
+            "description": description,
+            "imageUrl": image_url,
+            "videoUrl": video_url,
+            "imageSize": image_size,
+            "imageSha256": image_sha256,
+            "videoSize": video_size,
+            "videoSha256": video_sha256,
+            "status": "processing",
+            "videoStatus": "processing",
+        }
+        result = await ads_collection.insert_one(doc)
+    except BaseException:
+        # Don't leave files behind for an ad that doesn't exist
+        for path in stored:
+            os.remove(path)
+        raise
+    await bump_catalog_version(db)
     doc_id = str(result.inserted_id)
     doc["_id"] = doc_id
 
-    # Initialize ORB detector for the new ad
-    marker = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if marker is not None:
-        # Resize image to standard size for consistent feature detection
-        marker = cv2.resize(marker, (500, 500))
-        orb = cv2.ORB_create(1000)  # Reduced features for faster detection
-        kp_marker, des_marker = orb.detectAndCompute(marker, None)
-        orb_detectors[doc_id] = {
-            "kp": kp_marker,
-            "des": des_marker,
-            "shape": marker.shape,
-            "video_url": video_url,
-            "name": name
-        }
-        print(f"Initialized detector for new ad {doc_id} with {len(kp_marker)} features")
+    # Marker features are extracted in the background; poll /api/ads/{id}/status
+    submit_marker_job(doc_id, name, video_url, image_path)
+    submit_video_job(doc_id, video_path)
 
     return JSONResponse({"message": "Ad created successfully", **doc})
 
+# GET marker processing status of an ad
+@app.get("/api/ads/{ad_id}/status")
+async def get_ad_status(ad_id: str):
+    try:
+        ad = await ads_collection.find_one(
+            {"_id": ObjectId(ad_id)},
+            {"status": 1, "error": 1, "featureCount": 1, "videoStatus": 1, "videoError": 1},
+        )
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid ad ID")
+    if not ad:
+        raise HTTPException(status_code=404, detail="Ad not found")
+    return {
+        "_id": ad_id,
+        "status": ad.get("status", "ready"),
+        "error": ad.get("error"),
+        "featureCount": ad.get("featureCount"),
+        "videoStatus": ad.get("videoStatus"),
+        "videoError": ad.get("videoError"),
+        "queuedJobs": job_queue.pending(),
+    }
+
 # PUT update ad
 @app.put("/api/ads/{ad_id}")
 async def update_ad(ad_id: str, ad_update: AdUpdate):
@@ -167,9 +420,12 @@ async def update_ad(ad_id: str, ad_update: AdUpdate):
         )
         
         if result.modified_count == 1:
+            await bump_catalog_version(db)
             # Update the detector if name changed
-            if "name" in update_data and ad_id in orb_detectors:
-                orb_detectors[ad_id]["name"] = update_data["name"]
+            if "name" in update_data:
+                await registry_rename(ad_id, update_data["name"])
+                if registry_events is not None:
+                    registry_events.publish(rename_event(ad_id, update_data["name"]))
             
             return JSONResponse({"message": "Ad updated successfully"})
         else:
@@ -196,13 +452,19 @@ async def delete_ad(ad_id: str):
                 if os.path.exists(video_path):
                     os.remove(video_path)
             
+            for path in rendition_paths(ad):
+                if os.path.exists(path):
+                    os.remove(path)
+            
             # Remove from MongoDB
             result = await ads_collection.delete_one({"_id": ObjectId(ad_id)})
             
             if result.deleted_count == 1:
+                await bump_catalog_version(db)
                 # Remove from ORB detectors
-                if ad_id in orb_detectors:
-                    del orb_detectors[ad_id]
+                await registry_remove(ad_id)
+                if registry_events is not None:
+                    registry_events.publish(delete_event(ad_id))
                 
                 return JSONResponse({"message": "Ad deleted successfully"})
             else:
@@ -212,350 +474,149 @@ async def delete_ad(ad_id: str):
     except:
         raise HTTPException(status_code=400, detail="Invalid ad ID")
 
-# WebSocket endpoint for real-time detection
-# @app.websocket("/ws/detect")
+# WebSocket endpoint for real-time detection with better error handling
+@app.websocket("/ws/detect")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    connection_id = id(websocket)
+    
+    # Beyond capacity new clients are turned away (or admitted degraded)
+    # rather than slowing down everyone already connected
+    tier = rate_controller.admit(connection_id) if rate_controller is not None else None
+    if rate_controller is not None and tier is None:
+        metrics.detection_admissions_total.inc(result="rejected")
+        await websocket.send_text(json.dumps({
+            "type": "rejected",
+            "reason": "Server at capacity",
+            "retryAfter": ADMISSION_RETRY_SECONDS,
+        }))
+        # 1013 = Try Again Later
+        await websocket.close(code=1013)
+        return
+    if tier is not None:
+        metrics.detection_admissions_total.inc(result=tier)
     active_connections.append(websocket)
     
     # Initialize detection state for this connection
-    connection_id = id(websocket)
-    detection_states[connection_id] = {
-        "active_ad": None,
-        "active_since": None,
-        "last_position": None,
-        "detection_threshold": 3,  # Reduced threshold for faster detection
-    }
+    detection_states[connection_id] = new_detection_state()
     
-    # Initialize BFMatcher for faster performance
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    # Receiver and processor run as separate tasks joined by a one-frame slot,
+    # so results never lag more than one processing time behind the camera
+    slot = LatestFrameSlot()
+    send_lock = asyncio.Lock()
+    processed = 0
+    stats = connection_stats[connection_id] = {"fps": 0.0, "dropped": 0}
     
-    try:
-        while True:
-            # Receive base64 encoded image from client
-            data = await websocket.receive_text()
-            
-            # Decode base64 to image
-            image_data = base64.b64decode(data)
-            image = Image.open(io.BytesIO(image_data))
-            frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
-            # Preprocess frame for better feature detection
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            gray = cv2.GaussianBlur(gray, (3, 3), 0)  # Light blur for noise reduction
-            
-            # Detect ads
-            detected_ads = []
-            
-            # Initialize ORB for frame
-            orb = cv2.ORB_create(800)  # Reduced features for faster detection
-            kp_frame, des_frame = orb.detectAndCompute(gray, None)
-            
-            current_state = detection_states[connection_id]
-            
-            # If we have an active ad that was recently detected, check if it's still visible first
-            if (current_state["active_ad"] and 
-                current_state["active_since"] and 
-                time.time() - current_state["active_since"] < 5):  # Active for 5 seconds max
-                
-                ad_id = current_state["active_ad"]
-                detector = orb_detectors.get(ad_id)
-                
-                if detector and detector["des"] is not None and des_frame is not None:
-                    # Quick check for the active ad
-                    matches = bf.match(detector["des"], des_frame)
-                    matches = sorted(matches, key=lambda x: x.distance)
-                    
-                    # If we still have a good match, use the last known position
-                    if len(matches) > 10 and matches[0].distance < 50:
-                        detected_ads.append({
-                            "id": ad_id,
-                            "videoUrl": detector["video_url"],
-                            "name": detector["name"],
-                            "status": "active"  # Indicate this is an active tracking
-                        })
-                        await websocket.send_text(json.dumps(detected_ads))
-                        continue
-            
-            # If no active ad or active ad not found, check all ads
-            if des_frame is not None and len(kp_frame) > 15:
-                best_match = None
-                best_match_score = 0
-                
-                for ad_id, detector in orb_detectors.items():
-                    if detector["des"] is not None and len(detector["kp"]) > 8:
-                        try:
-                            # Use BFMatcher for speed
-                            matches = bf.match(detector["des"], des_frame)
-                            matches = sorted(matches, key=lambda x: x.distance)
-                            
-                            # Simple threshold based on good matches
-                            good_matches = [m for m in matches if m.distance < 50]
-                            
-                            if len(good_matches) > 12:
-                                # Calculate match quality score
-                                match_score = len(good_matches) / len(detector["kp"]) if len(detector["kp"]) > 0 else 0
-                                
-                                if match_score > best_match_score:
-                                    best_match_score = match_score
-                                    best_match = (ad_id, detector, good_matches, kp_frame)
-                                    
-                        except Exception as e:
-                            print(f"Error matching features for ad {ad_id}: {e}")
-                            continue
-                
-                # Process the best match
-                if best_match and best_match_score > 0.15:
-                    ad_id, detector, good_matches, kp_frame = best_match
-                    
-                    src_pts = np.float32([detector["kp"][m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                    dst_pts = np.float32([kp_frame[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                    
-                    try:
-                        H, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-                        
-                        if H is not None:
-                            h, w = detector["shape"]
-                            pts = np.float32([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
-                            dst = cv2.perspectiveTransform(pts, H)
-                            
-                            # Calculate bounding box
-                            x_coords = [point[0][0] for point in dst]
-                            y_coords = [point[0][1] for point in dst]
-                            
-                            x_min, x_max = min(x_coords), max(x_coords)
-                            y_min, y_max = min(y_coords), max(y_coords)
-                            
-                            # Normalize coordinates to percentage of frame size
-                            frame_height, frame_width = frame.shape[:2]
-                            
-                            # Update detection state
-                            current_state["active_ad"] = ad_id
-                            current_state["active_since"] = time.time()
-                            current_state["last_position"] = {
-                                "x": float((x_min / frame_width) * 100),
-                                "y": float((y_min / frame_height) * 100),
-                                "width": float(((x_max - x_min) / frame_width) * 100),
-                                "height": float(((y_max - y_min) / frame_height) * 100),
-                            }
-                            
-                            detected_ads.append({
-                                "id": ad_id,
-                                "x": float((x_min / frame_width) * 100),
-                                "y": float((y_min / frame_height) * 100),
-                                "width": float(((x_max - x_min) / frame_width) * 100),
-                                "height": float(((y_max - y_min) / frame_height) * 100),
-                                "videoUrl": detector["video_url"],
-                                "name": detector["name"],
-                                "score": float(best_match_score),
-                                "status": "new"  # Indicate this is a new detection
-                            })
-                    except Exception as e:
-                        print(f"Error calculating homography: {e}")
-            
-            # If no ads detected but we have an active ad, continue tracking it
-            elif current_state["active_ad"] and current_state["last_position"]:
-                ad_id = current_state["active_ad"]
-                detector = orb_detectors.get(ad_id)
-                
-                if detector:
-                    detected_ads.append({
-                        "id": ad_id,
-                        **current_state["last_position"],
-                        "videoUrl": detector["video_url"],
-                        "name": detector["name"],
-                        "status": "tracking"  # Indicate this is continued tracking
-                    })
-            
-            # Send detected ads back to client
-            await websocket.send_text(json.dumps(detected_ads))
-            
-    except WebSocketDisconnect:
-        if connection_id in detection_states:
-            del detection_states[connection_id]
-        active_connections.remove(websocket)
-    except Exception as e:
-        print(f"WebSocket error: {e}")
-        if connection_id in detection_states:
-            del detection_states[connection_id]
-        active_connections.remove(websocket)
-# WebSocket endpoint for real-time detection with better error handling
-@app.websocket("/ws/detect")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    active_connections.append(websocket)
+    # ?results=compact: ad metadata once, then small binary deltas (see detection.result_stream)
+    encoder = CompactResultEncoder() if websocket.query_params.get("results") == "compact" else None
     
-    # Initialize detection state for this connection
-    connection_id = id(websocket)
-    detection_states[connection_id] = {
-        "active_ad": None,
-        "active_since": None,
-        "last_position": None,
-        "detection_threshold": 3,
-    }
+    async def send_json(payload):
+        async with send_lock:
+            await websocket.send_text(json.dumps(payload))
     
-    # Initialize BFMatcher for faster performance
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    async def send_bytes(payload):
+        async with send_lock:
+            await websocket.send_bytes(payload)
     
-    try:
+    async def receive_frames():
         while True:
             try:
                 # Add timeout to prevent hanging
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
+                message = await asyncio.wait_for(websocket.receive(), timeout=30.0)
             except asyncio.TimeoutError:
                 # Send ping to keep connection alive
-                await websocket.send_text(json.dumps({"type": "ping", "message": "keepalive"}))
+                await send_json({"type": "ping", "message": "keepalive"})
                 continue
             
-            # Decode base64 to image
-            try:
-                image_data = base64.b64decode(data)
-                image = Image.open(io.BytesIO(image_data))
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            except Exception as e:
-                print(f"Error decoding image: {e}")
-                continue
-            
-            # Preprocess frame for better feature detection
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            gray = cv2.GaussianBlur(gray, (3, 3), 0)  # Light blur for noise reduction
-            
-            # Detect ads
-            detected_ads = []
-            
-            # Initialize ORB for frame
-            orb = cv2.ORB_create(800)  # Reduced features for faster detection
-            kp_frame, des_frame = orb.detectAndCompute(gray, None)
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            current_state = detection_states[connection_id]
-            
-            # If we have an active ad that was recently detected, check if it's still visible first
-            if (current_state["active_ad"] and 
-                current_state["active_since"] and 
-                time.time() - current_state["active_since"] < 5):  # Active for 5 seconds max
-                
-                ad_id = current_state["active_ad"]
-                detector = orb_detectors.get(ad_id)
-                
-                if detector and detector["des"] is not None and des_frame is not None:
-                    # Quick check for the active ad
-                    matches = bf.match(detector["des"], des_frame)
-                    matches = sorted(matches, key=lambda x: x.distance)
-                    
-                    # If we still have a good match, use the last known position
-                    if len(matches) > 10 and matches[0].distance < 50:
-                        detected_ads.append({
-                            "id": ad_id,
-                            "videoUrl": detector["video_url"],
-                            "name": detector["name"],
-                            "status": "active"
-                        })
-                        await websocket.send_text(json.dumps(detected_ads))
-                        continue
-            
-            # If no active ad or active ad not found, check all ads
-            if des_frame is not None and len(kp_frame) > 15:
-                best_match = None
-                best_match_score = 0
-                
-                for ad_id, detector in orb_detectors.items():
-                    if detector["des"] is not None and len(detector["kp"]) > 8:
-                        try:
-                            # Use BFMatcher for speed
-                            matches = bf.match(detector["des"], des_frame)
-                            matches = sorted(matches, key=lambda x: x.distance)
-                            
-                            # Simple threshold based on good matches
-                            good_matches = [m for m in matches if m.distance < 50]
-                            
-                            if len(good_matches) > 12:
-                                # Calculate match quality score
-                                match_score = len(good_matches) / len(detector["kp"]) if len(detector["kp"]) > 0 else 0
-                                
-                                if match_score > best_match_score:
-                                    best_match_score = match_score
-                                    best_match = (ad_id, detector, good_matches, kp_frame)
-                                    
-                        except Exception as e:
-                            print(f"Error matching features for ad {ad_id}: {e}")
-                            continue
-                
-                # Process the best match
-                if best_match and best_match_score > 0.15:
-                    ad_id, detector, good_matches, kp_frame = best_match
-                    
-                    src_pts = np.float32([detector["kp"][m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                    dst_pts = np.float32([kp_frame[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                    
-                    try:
-                        H, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-                        
-                        if H is not None:
-                            h, w = detector["shape"]
-                            pts = np.float32([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
-                            dst = cv2.perspectiveTransform(pts, H)
-                            
-                            # Calculate bounding box
-                            x_coords = [point[0][0] for point in dst]
-                            y_coords = [point[0][1] for point in dst]
-                            
-                            x_min, x_max = min(x_coords), max(x_coords)
-                            y_min, y_max = min(y_coords), max(y_coords)
-                            
-                            # Normalize coordinates to percentage of frame size
-                            frame_height, frame_width = frame.shape[:2]
-                            
-                            # Update detection state
-                            current_state["active_ad"] = ad_id
-                            current_state["active_since"] = time.time()
-                            current_state["last_position"] = {
-                                "x": float((x_min / frame_width) * 100),
-                                "y": float((y_min / frame_height) * 100),
-                                "width": float(((x_max - x_min) / frame_width) * 100),
-                                "height": float(((y_max - y_min) / frame_height) * 100),
-                            }
-                            
-                            detected_ads.append({
-                                "id": ad_id,
-                                "x": float((x_min / frame_width) * 100),
-                                "y": float((y_min / frame_height) * 100),
-                                "width": float(((x_max - x_min) / frame_width) * 100),
-                                "height": float(((y_max - y_min) / frame_height) * 100),
-                                "videoUrl": detector["video_url"],
-                                "name": detector["name"],
-                                "score": float(best_match_score),
-                                "status": "new"
-                            })
-                    except Exception as e:
-                        print(f"Error calculating homography: {e}")
+            # Binary frames (header + JPEG) or base64 text from old clients
+            data = message.get("bytes")
+            if data is None:
+                data = message.get("text")
+            if data is not None and slot.put(data):
+                stats["dropped"] += 1
+                metrics.detection_dropped_frames_total.inc()
+    
+    last_control = None
+    
+    async def send_control():
+        # Tell the client how fast, how large and at what quality to send frames
+        nonlocal last_control
+        if rate_controller is None:
+            return
+        control = rate_controller.targets(connection_id, detection_states[connection_id]["max_side"])
+        if control is not None and control_changed(control, last_control):
+            last_control = control
+            await send_json(control)
+    
+    async def process_frames():
+        nonlocal processed
+        last_stats = time.monotonic()
+        last_frame = None
+        await send_control()
+        while True:
+            data = await slot.get()
             
-            # If no ads detected but we have an active ad, continue tracking it
-            elif current_state["active_ad"] and current_state["last_position"]:
-                ad_id = current_state["active_ad"]
-                detector = orb_detectors.get(ad_id)
-                
-                if detector:
-                    detected_ads.append({
-                        "id": ad_id,
-                        **current_state["last_position"],
-                        "videoUrl": detector["video_url"],
-                        "name": detector["name"],
-                        "status": "tracking"
-                    })
+            # Decode + detect in the worker pool so other sockets keep being served
+            detected_ads, state = await detection_executor.run(data, detection_states[connection_id])
+            detection_states[connection_id] = state
+            processed += 1
+            stage_ms = state.get("stage_ms", {})
+            if rate_controller is not None and stage_ms:
+                rate_controller.observe(connection_id, sum(stage_ms.values()))
+            if detected_ads is not None:
+                # Send detected ads back to client
+                send_started = time.perf_counter()
+                if encoder is None:
+                    await send_json(detected_ads)
+                else:
+                    for message in encoder.encode(detected_ads):
+                        if isinstance(message, bytes):
+                            await send_bytes(message)
+                        else:
+                            await send_json(message)
+                stage_ms["send"] = (time.perf_counter() - send_started) * 1000
+            metrics.observe_frame(stage_ms, detected_ads)
             
-            # Send detected ads back to client
-            await websocket.send_text(json.dumps(detected_ads))
+            now = time.monotonic()
+            if last_frame is not None and now > last_frame:
+                stats["fps"] = 0.8 * stats["fps"] + 0.2 / (now - last_frame)
+            last_frame = now
             
+            if time.monotonic() - last_stats >= STATS_INTERVAL:
+                last_stats = time.monotonic()
+                await send_json({"type": "stats", "processed": processed, "dropped": slot.dropped})
+                await send_control()
+    
+    receiver = asyncio.create_task(receive_frames())
+    processor = asyncio.create_task(process_frames())
+    try:
+        done, _ = await asyncio.wait({receiver, processor}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
     except WebSocketDisconnect:
         print(f"WebSocket disconnected: {connection_id}")
     except Exception as e:
         print(f"WebSocket error: {e}")
     finally:
         # Cleanup
+        receiver.cancel()
+        processor.cancel()
+        print(f"Connection {connection_id}: {processed} frames processed, {slot.dropped} dropped")
         if connection_id in detection_states:
             del detection_states[connection_id]
+        connection_stats.pop(connection_id, None)
+        if rate_controller is not None:
+            rate_controller.release(connection_id)
         if websocket in active_connections:
             active_connections.remove(websocket)
+# Prometheus scrape endpoint
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def root():
     return {"message": "Add-to-Video backend running"}
\ No newline at end of file
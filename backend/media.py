@@ -0,0 +1,192 @@
+import os
+import tempfile
+
+import cv2
+
+# ---------------------------
+# Video ingest: lower-resolution renditions, a poster frame and a short
+# preview clip, all written in one decode pass over the uploaded video.
+# ---------------------------
+RENDITION_HEIGHTS = [int(h) for h in os.environ.get("RENDITION_HEIGHTS", "240,360,720").split(",") if h]
+PREVIEW_SECONDS = float(os.environ.get("PREVIEW_SECONDS", 3.0))
+POSTER_SECONDS = float(os.environ.get("POSTER_SECONDS", 0.5))
+POSTER_JPEG_QUALITY = 80
+RENDITION_DIR = "static/videos/renditions"
+
+# (fourcc, extension, MIME type) by preference. Browsers play H.264 in MP4 and
+# VP9/VP8 in WebM, but not MPEG-4 Part 2 ("mp4v"). The pip OpenCV wheels have
+# no H.264 encoder but do write VP9.
+FORMATS = [
+    ("avc1", ".mp4", "video/mp4"),
+    ("VP90", ".webm", "video/webm"),
+    ("VP80", ".webm", "video/webm"),
+]
+
+_video_format = False
+
+
+def video_format():
+    """First entry of FORMATS this OpenCV build can write, or None (probed once per process)."""
+    global _video_format
+    if _video_format is False:
+        _video_format = None
+        for fourcc, extension, mime_type in FORMATS:
+            fd, path = tempfile.mkstemp(suffix=extension)
+            os.close(fd)
+            try:
+                writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), 30.0, (64, 64))
+                opened = writer.isOpened()
+                writer.release()
+            finally:
+                os.remove(path)
+            if opened:
+                _video_format = (fourcc, extension, mime_type)
+                break
+        if _video_format is None:
+            print("No browser-playable video encoder in this OpenCV build: serving original videos only")
+    return _video_format
+
+
+def _open_writer(path, fourcc, fps, size):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        writer.release()
+        raise RuntimeError(f"Could not open a {fourcc} writer for {path}")
+    return writer
+
+
+def _even(value):
+    # Most encoders need even dimensions
+    return max(2, int(round(value / 2)) * 2)
+
+
+def _to_url(path):
+    return "/" + path.replace(os.sep, "/")
+
+
+class _Output:
+    """A VideoWriter that writes to a temp file and is renamed on commit."""
+
+    def __init__(self, path, video_format, fps, size, max_frames=None):
+        self.path = path
+        self.mime_type = video_format[2]
+        self.size = size
+        self.max_frames = max_frames
+        self.frames = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=video_format[1])
+        os.close(fd)
+        self.writer = _open_writer(self.tmp_path, video_format[0], fps, size)
+
+    def write(self, frame):
+        if self.max_frames is not None and self.frames >= self.max_frames:
+            return
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        self.writer.write(frame)
+        self.frames += 1
+
+    def commit(self):
+        self.writer.release()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self.writer.release()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def build_renditions(video_path, out_dir=RENDITION_DIR, heights=RENDITION_HEIGHTS):
+    """Transcode video_path into smaller renditions, a poster and a preview.
+
+    Returns a dict for the ad document:
+        {"renditions": [{"width", "height", "url", "bytes", "mimeType"}, ...]
+         smallest first, "posterUrl", "previewUrl", "previewMimeType",
+         "durationSeconds"}
+    Only heights below the source height are produced. Audio is dropped,
+    the overlay plays muted. Videos are H.264 MP4 when the OpenCV build has
+    an H.264 encoder and VP9/VP8 WebM otherwise (see video_format). With
+    neither there are no renditions and previewUrl is None; the poster is
+    still made.
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {video_path}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    outputs = []
+    preview = None
+    try:
+        fmt = video_format()
+        if fmt is not None:
+            extension = fmt[1]
+            for target in sorted(h for h in heights if h < height):
+                size = (_even(width * target / height), _even(target))
+                outputs.append(_Output(os.path.join(out_dir, f"{stem}-{target}p{extension}"), fmt, fps, size))
+            # Preview at the smallest size we have
+            preview_size = outputs[0].size if outputs else (_even(width), _even(height))
+            preview = _Output(
+                os.path.join(out_dir, f"{stem}-preview{extension}"), fmt, fps, preview_size,
+                max_frames=int(PREVIEW_SECONDS * fps),
+            )
+
+        poster = None
+        poster_frame = int(POSTER_SECONDS * fps)
+        frames = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if poster is None or frames == poster_frame:
+                poster = frame
+            # Every output is resized from the full-quality source frame
+            for output in outputs:
+                output.write(frame)
+            if preview is not None:
+                preview.write(frame)
+            frames += 1
+
+        if frames == 0:
+            raise ValueError(f"No frames decoded from {video_path}")
+
+        poster_path = os.path.join(out_dir, f"{stem}-poster.jpg")
+        ok, jpeg = cv2.imencode(".jpg", poster, [cv2.IMWRITE_JPEG_QUALITY, POSTER_JPEG_QUALITY])
+        with open(poster_path, "wb") as f:
+            f.write(jpeg.tobytes())
+
+        for output in outputs + ([preview] if preview is not None else []):
+            output.commit()
+    except BaseException:
+        for output in outputs + ([preview] if preview is not None else []):
+            output.discard()
+        raise
+    finally:
+        capture.release()
+
+    return {
+        "renditions": [
+            {
+                "width": output.size[0],
+                "height": output.size[1],
+                "url": _to_url(output.path),
+                "bytes": os.path.getsize(output.path),
+                "mimeType": output.mime_type,
+            }
+            for output in outputs
+        ],
+        "posterUrl": _to_url(poster_path),
+        "previewUrl": _to_url(preview.path) if preview is not None else None,
+        "previewMimeType": preview.mime_type if preview is not None else None,
+        "durationSeconds": round(frames / fps, 2),
+    }
+
+
+def rendition_paths(ad):
+    """Files created by build_renditions for an ad document, for cleanup."""
+    urls = [r["url"] for r in ad.get("renditions", [])]
+    urls += [ad[key] for key in ("posterUrl", "previewUrl") if ad.get(key)]
+    return [url.lstrip("/").replace("/", os.sep) for url in urls]
@@ -0,0 +1,120 @@
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from gridfs.errors import NoFile
+
+# ---------------------------
+# GridFS media streaming with HTTP Range and conditional requests.
+# Files are read one GridFS chunk at a time, so memory per request stays at
+# about one chunk (255 kB by default) whatever the file size.
+# ---------------------------
+
+# GridFS files are never modified in place (a new upload gets a new id)
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, length):
+    """Parse a single-range Range header into (start, end) inclusive.
+
+    Returns None to serve the whole file (no header, several ranges, or a
+    syntax we don't handle) and raises ValueError if it's unsatisfiable.
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("empty suffix range")
+        return max(0, length - suffix), length - 1
+    start = int(first)
+    end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def _not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def _iter_file(grid_out, start, length):
+    grid_out.seek(start)
+    remaining = length
+    while remaining > 0:
+        chunk = await grid_out.read(min(grid_out.chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def gridfs_response(fs, file_id, request):
+    """Stream a GridFS file, honouring Range, If-Range and conditional headers."""
+    try:
+        grid_out = await fs.open_download_stream(ObjectId(file_id))
+    except (InvalidId, NoFile):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    length = grid_out.length
+    last_modified = (grid_out.upload_date or datetime.now(timezone.utc)).replace(tzinfo=timezone.utc)
+    etag = f'"{grid_out._id}"'
+    metadata = grid_out.metadata or {}
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+    }
+    media_type = metadata.get("content_type") or "application/octet-stream"
+
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range.strip() != etag and if_range.strip() != headers["Last-Modified"]:
+        # The client's partial copy is stale: send the whole file
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, length)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{length}"})
+
+    if byte_range is None:
+        start, end, status_code = 0, length - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        _iter_file(grid_out, start, end - start + 1),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type,
+    )
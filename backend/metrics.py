@@ -0,0 +1,143 @@
+import threading
+from bisect import bisect_left
+
+# ---------------------------
+# Minimal Prometheus text-format metrics (no client library needed).
+# Observations are a bisect + a few adds under a lock, cheap enough for the
+# per-frame path.
+# ---------------------------
+
+_metrics = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose samples are produced at scrape time by a callback.
+
+    The callback returns a number, or a list of (labels dict, value) pairs.
+    """
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        samples = self.callback()
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(sorted(labels.items()))} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = sorted(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, n in zip(self.buckets + [float("inf")], counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------
+# Detection metrics
+# ---------------------------
+STAGE_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+
+detection_stage_seconds = Histogram(
+    "detection_stage_seconds",
+    "Time spent per detection stage (decode, preprocess, track, orb, match, homography, send)",
+    STAGE_BUCKETS,
+)
+detection_frame_seconds = Histogram(
+    "detection_frame_seconds",
+    "Total time per frame across all stages, including the send",
+    STAGE_BUCKETS,
+)
+detection_outcomes_total = Counter(
+    "detection_outcomes_total",
+    "Processed frames by result status (new/active/tracking/none, skipped = undecodable or stale)",
+)
+detection_dropped_frames_total = Counter(
+    "detection_dropped_frames_total",
+    "Frames replaced in the latest-frame slot before being processed",
+)
+detection_admissions_total = Counter(
+    "detection_admissions_total",
+    "/ws/detect connection attempts by admission result (full/degraded/rejected)",
+)
+
+
+def observe_frame(stage_ms, detected_ads):
+    """Record the stage timings and outcome of one processed frame."""
+    total = 0.0
+    for stage, ms in stage_ms.items():
+        detection_stage_seconds.observe(ms / 1000, stage=stage)
+        total += ms
+    detection_frame_seconds.observe(total / 1000)
+    if detected_ads is None:
+        status = "skipped"
+    else:
+        status = detected_ads[0].get("status", "none") if detected_ads else "none"
+    detection_outcomes_total.inc(status=status)
@@ -1,29 +1,30 @@
 
 
-from fastapi import APIRouter, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from config import db
-import os, shutil, uuid
+from catalog import catalog_cache_headers, list_ads, bump_catalog_version, DEFAULT_PAGE_SIZE
+from typing import Optional
+import os, uuid
+from uploads import check_upload, save_upload, MAX_IMAGE_BYTES, MAX_VIDEO_BYTES
 
 router = APIRouter()
 
-# ---------------------------
-# Helper: convert MongoDB doc → JSON
-# ---------------------------
-def serialize_ad(ad):
-    ad["_id"] = str(ad["_id"])
-    return ad
-
 # ---------------------------
 # Get all adsa
 # ---------------------------
 @router.get("/ads")
-async def get_ads():
-    print("📢 /ads route called!")  # DEBUG
-    ads = await db.ads.find().to_list(100)
-    print(f"📢 Found {len(ads)} ads in DB")  # DEBUG
-    ads = [serialize_ad(ad) for ad in ads]
-    return JSONResponse(content=ads)
+async def get_ads(request: Request, after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE, fields: Optional[str] = None):
+    headers, not_modified = await catalog_cache_headers(db, request)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    try:
+        ads, next_cursor = await list_ads(db.ads, after, limit, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return JSONResponse(content=ads, headers=headers)
 
 # ---------------------------
 # Create new ad
@@ -35,7 +36,9 @@ async def create_ad(
     video: UploadFile = File(...),
     image: UploadFile = File(...),
 ):
-    print(f"📢 Uploading new ad: {name}")  # DEBUG
+    # Check both files before storing either
+    check_upload(image, "image")
+    check_upload(video, "video")
 
     # Directories
     video_dir = "static/videos"
@@ -46,35 +49,39 @@ async def create_ad(
     # Create unique ID for filenames
     ad_id = str(uuid.uuid4())
 
-    # ---- Save Video ----
-    video_ext = os.path.splitext(video.filename)[1]  # keep .mp4/.mov/etc
-    video_filename = f"{ad_id}_video{video_ext}"
-    video_path = os.path.join(video_dir, video_filename)
-    with open(video_path, "wb") as buffer:
-        shutil.copyfileobj(video.file, buffer)
-    print(f"📢 Video saved at {video_path}")
-
     # ---- Save Image ----
     image_ext = os.path.splitext(image.filename)[1]  # keep .png/.jpg
     image_filename = f"{ad_id}_image{image_ext}"
     image_path = os.path.join(image_dir, image_filename)
-    with open(image_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
-    print(f"📢 Image saved at {image_path}")
+    await save_upload(image, image_path, MAX_IMAGE_BYTES)
+
+    # ---- Save Video ----
+    video_ext = os.path.splitext(video.filename)[1]  # keep .mp4/.mov/etc
+    video_filename = f"{ad_id}_video{video_ext}"
+    video_path = os.path.join(video_dir, video_filename)
+    stored = [image_path]
+    try:
+        await save_upload(video, video_path, MAX_VIDEO_BYTES)
+        stored.append(video_path)
 
-    # URLs for frontend
-    video_url = f"/static/videos/{video_filename}"
-    image_url = f"/static/images/{image_filename}"
+        # URLs for frontend
+        video_url = f"/static/videos/{video_filename}"
+        image_url = f"/static/images/{image_filename}"
 
-    # Save to MongoDB
-    ad_doc = {
-        "name": name,
-        "description": description, 
-        "videoUrl": video_url,
-        "imageUrl": image_url,
-    }
-    result = await db.ads.insert_one(ad_doc)
+        # Save to MongoDB
+        ad_doc = {
+            "name": name,
+            "description": description,
+            "videoUrl": video_url,
+            "imageUrl": image_url,
+        }
+        result = await db.ads.insert_one(ad_doc)
+    except BaseException:
+        # Don't leave files behind for an ad that doesn't exist
+        for path in stored:
+            os.remove(path)
+        raise
+    await bump_catalog_version(db)
     ad_doc["_id"] = str(result.inserted_id)
 
-    print("📢 Ad inserted with ID:", ad_doc["_id"])
     return JSONResponse(content=ad_doc)
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from fastapi import HTTPException
+from fastapi.responses import PlainTextResponse
+
+# ---------------------------
+# Streaming uploads: read the request body in fixed-size chunks, hash while
+# writing, and only make the file visible once it's complete.
+# ---------------------------
+UPLOAD_CHUNK_BYTES = int(os.environ.get("UPLOAD_CHUNK_BYTES", 1024 * 1024))
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", 20 * 1024 * 1024))
+MAX_VIDEO_BYTES = int(os.environ.get("MAX_VIDEO_BYTES", 500 * 1024 * 1024))
+# A create request carries one image, one video and a few form fields
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", MAX_IMAGE_BYTES + MAX_VIDEO_BYTES + 1024 * 1024))
+
+
+class UploadLimitMiddleware:
+    """Reject multipart requests over max_bytes from their Content-Length.
+
+    Starlette spools the whole form to disk before a handler runs, so the
+    limits in save_upload only bound what gets stored. This answers 413
+    before any of the body is read, and 411 when a multipart request has no
+    Content-Length to check.
+    """
+
+    def __init__(self, app, max_bytes=MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            if headers.get(b"content-type", b"").startswith(b"multipart/"):
+                response = None
+                length = headers.get(b"content-length")
+                if length is None or not length.isdigit():
+                    response = PlainTextResponse("Content-Length required", status_code=411)
+                elif int(length) > self.max_bytes:
+                    response = PlainTextResponse(
+                        f"Request is larger than {self.max_bytes // (1024 * 1024)} MB", status_code=413,
+                    )
+                if response is not None:
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+def _too_large(upload, max_bytes):
+    return HTTPException(
+        status_code=413,
+        detail=f"{upload.filename} is larger than {max_bytes // (1024 * 1024)} MB",
+    )
+
+
+def check_upload(upload, kind):
+    """Reject an UploadFile that isn't a kind ("image" or "video") file.
+
+    Only looks at the name and declared type, so call it for every file of a
+    request before storing any of them.
+    """
+    filename = os.path.basename(upload.filename or "")
+    if not filename:
+        raise HTTPException(status_code=400, detail=f"Missing {kind} file")
+    # Clients often send application/octet-stream: fall back to the extension
+    content_type = upload.content_type or ""
+    if not content_type.startswith(f"{kind}/"):
+        content_type = mimetypes.guess_type(filename)[0] or content_type
+    if not content_type.startswith(f"{kind}/"):
+        raise HTTPException(
+            status_code=415,
+            detail=f"{filename} is not a {kind} file ({content_type or 'unknown type'})",
+        )
+
+
+def _write_chunk(f, digest, chunk):
+    digest.update(chunk)
+    f.write(chunk)
+
+
+async def save_upload(upload, path, max_bytes, chunk_size=UPLOAD_CHUNK_BYTES):
+    """Stream an UploadFile to path through a temp file in the same directory.
+
+    Returns (size, sha256 hex). Raises HTTPException(413) past max_bytes; on
+    any failure the temp file is removed and path is left untouched.
+    max_bytes only bounds what gets stored: the request has already been
+    received in full, UploadLimitMiddleware is what caps the upload itself.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(upload, max_bytes)
+                # Disk writes and hashing stay off the event loop
+                await asyncio.to_thread(_write_chunk, f, digest, chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size, digest.hexdigest()
+
+
+async def upload_to_gridfs(fs, upload, max_bytes, metadata=None, chunk_size=UPLOAD_CHUNK_BYTES):
+    """Stream an UploadFile into a GridFS bucket.
+
+    Returns (file_id, size, sha256 hex). GridFS only makes the file visible
+    when the files document is written on close, and an aborted stream
+    deletes the chunks written so far. As with save_upload, max_bytes only
+    bounds what gets stored.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    grid_in = fs.open_upload_stream(upload.filename, metadata=metadata)
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise _too_large(upload, max_bytes)
+            await asyncio.to_thread(digest.update, chunk)
+            await grid_in.write(chunk)
+    except BaseException:
+        await grid_in.abort()
+        raise
+    await grid_in.set("sha256", digest.hexdigest())
+    await grid_in.close()
+    return grid_in._id, size, digest.hexdigest()
@@ -4,8 +4,31 @@ import AdDetector from "./components/AdDetector";
 import FixedBoxVideoOverlay from "./components/FixedBoxVideoOverlay";
 import AdminPanel from "./components/AdminPanel";
 import { BACKEND_URL } from "./config";
+import { fetchAllAds } from "./adsApi";
 import "./App.css";
 
+// Pick the smallest rendition that still looks sharp in the overlay; the
+// overlay rarely covers more than half the screen, and on slow links the
+// smallest one always wins
+const pickVideoSource = (mapping) => {
+  // Renditions are MP4 or WebM depending on the server's encoder; skip the
+  // ones this browser can't play and fall back to the original upload
+  const probe = document.createElement("video");
+  const renditions = (mapping.renditions || []).filter(
+    (r) => !r.mimeType || probe.canPlayType(r.mimeType) !== ""
+  );
+  if (renditions.length === 0) return mapping.videoUrl;
+
+  const connection = navigator.connection || {};
+  if (connection.saveData || ["slow-2g", "2g", "3g"].includes(connection.effectiveType)) {
+    return renditions[0].url;
+  }
+
+  const targetHeight = (window.innerHeight * (window.devicePixelRatio || 1)) / 2;
+  const suitable = renditions.find((r) => r.height >= targetHeight);
+  return (suitable || renditions[renditions.length - 1]).url;
+};
+
 function App() {
   const [hasCameraAccess, setHasCameraAccess] = useState(false);
   const [detectedAds, setDetectedAds] = useState([]);
@@ -18,13 +41,13 @@ function App() {
   useEffect(() => {
     const fetchMappings = async () => {
       try {
-        const response = await fetch(`${BACKEND_URL}/api/ads`);
-        const mappings = await response.json();
+        const mappings = await fetchAllAds(["name", "videoUrl", "renditions", "posterUrl"]);
         const videoMap = {};
         for (const mapping of mappings) {
           videoMap[mapping._id] = {
             id: mapping._id,
-            src: `${BACKEND_URL}${mapping.videoUrl}`,
+            src: `${BACKEND_URL}${pickVideoSource(mapping)}`,
+            poster: mapping.posterUrl ? `${BACKEND_URL}${mapping.posterUrl}` : undefined,
             name: mapping.name
           };
         }
@@ -0,0 +1,20 @@
+import { BACKEND_URL } from "./config";
+
+// Fetch every ad by following the X-Next-Cursor pages of /api/ads.
+// The server sends an ETag with Cache-Control: no-cache, so the browser
+// revalidates each page and unchanged pages come back as a cheap 304.
+export const fetchAllAds = async (fields) => {
+  const ads = [];
+  let after = null;
+  do {
+    const params = new URLSearchParams({ limit: "200" });
+    if (fields) params.set("fields", fields.join(","));
+    if (after) params.set("after", after);
+
+    const res = await fetch(`${BACKEND_URL}/api/ads?${params}`);
+    if (!res.ok) throw new Error(`Failed to fetch ads: ${res.status}`);
+    ads.push(...(await res.json()));
+    after = res.headers.get("X-Next-Cursor");
+  } while (after);
+  return ads;
+};
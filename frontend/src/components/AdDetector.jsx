@@ -1,12 +1,48 @@
 import React, { useEffect } from "react";
 
+const FRAME_HEADER_SIZE = 8;
+
+// Compact result stream (see backend detection/result_stream.py)
+const RESULT_KIND = 1;
+const RESULT_ENTRY_SIZE = 11;
+const STATUS_NAMES = { 1: "new", 2: "active", 3: "tracking" };
+
+// Turn a binary result message back into the JSON-mode array of ads
+const decodeCompactResult = (buffer, adTable) => {
+  const view = new DataView(buffer);
+  if (view.getUint8(0) !== RESULT_KIND) return null; // heartbeat
+  const count = view.getUint8(1);
+  const ads = [];
+  for (let i = 0; i < count; i++) {
+    const offset = 2 + i * RESULT_ENTRY_SIZE;
+    const meta = adTable[view.getUint16(offset, true)] || {};
+    ads.push({
+      id: meta.id,
+      name: meta.name,
+      videoUrl: meta.videoUrl,
+      status: STATUS_NAMES[view.getUint8(offset + 2)],
+      x: view.getInt16(offset + 3, true) / 100,
+      y: view.getInt16(offset + 5, true) / 100,
+      width: view.getUint16(offset + 7, true) / 100,
+      height: view.getUint16(offset + 9, true) / 100,
+    });
+  }
+  return ads;
+};
+
 const AdDetector = ({ videoRef, canvasRef, onAdDetected }) => {
   useEffect(() => {
     let ws = null;
     let animationFrameId = null;
     let reconnectTimeout = null;
     let isConnected = false;
-    let frameInterval = 150; // Process every 150ms (~6.5fps) for faster response
+    // Capture settings; the server adjusts them with "control" messages
+    let frameInterval = 150; // Process every 150ms (~6.5fps) until told otherwise
+    let maxSide = null; // Longest frame side to send (null = camera resolution)
+    let jpegQuality = 0.7;
+    let retryDelay = 2000;
+    let frameSeq = 0;
+    let adTable = {};
 
     const initWS = () => {
       if (ws && ws.readyState === WebSocket.OPEN) {
@@ -14,7 +50,9 @@ const AdDetector = ({ videoRef, canvasRef, onAdDetected }) => {
       }
 
       try {
-        ws = new WebSocket("ws://localhost:8000/ws/detect");
+        ws = new WebSocket("ws://localhost:8000/ws/detect?results=compact");
+        ws.binaryType = "arraybuffer";
+        adTable = {};
 
         ws.onopen = () => {
           console.log("✅ Connected to backend");
@@ -34,26 +72,35 @@ const AdDetector = ({ videoRef, canvasRef, onAdDetected }) => {
                 lastFrameTime = timestamp;
                 
                 const ctx = canvas.getContext("2d");
-                canvas.width = video.videoWidth;
-                canvas.height = video.videoHeight;
+                // Downscale to the size the server will process anyway
+                const scale = maxSide
+                  ? Math.min(1, maxSide / Math.max(video.videoWidth, video.videoHeight))
+                  : 1;
+                canvas.width = Math.round(video.videoWidth * scale);
+                canvas.height = Math.round(video.videoHeight * scale);
 
                 ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
                 
-                // Convert to JPEG and send as base64
+                // Convert to JPEG and send as a binary frame:
+                // uint32 seq | uint16 width | uint16 height | JPEG bytes (little endian)
+                const width = canvas.width;
+                const height = canvas.height;
                 canvas.toBlob(
-                  (blob) => {
+                  async (blob) => {
                     if (blob && ws && ws.readyState === WebSocket.OPEN) {
-                      const reader = new FileReader();
-                      reader.onloadend = () => {
-                        // Strip header like "data:image/jpeg;base64,"
-                        const base64data = reader.result.split(",")[1];
-                        ws.send(base64data);
-                      };
-                      reader.readAsDataURL(blob);
+                      const jpeg = new Uint8Array(await blob.arrayBuffer());
+                      const message = new Uint8Array(FRAME_HEADER_SIZE + jpeg.length);
+                      const header = new DataView(message.buffer);
+                      header.setUint32(0, frameSeq, true);
+                      header.setUint16(4, width, true);
+                      header.setUint16(6, height, true);
+                      message.set(jpeg, FRAME_HEADER_SIZE);
+                      frameSeq = (frameSeq + 1) >>> 0;
+                      ws.send(message.buffer);
                     }
                   },
                   "image/jpeg",
-                  0.7 // Medium quality for faster transmission
+                  jpegQuality
                 );
               }
             }
@@ -66,21 +113,53 @@ const AdDetector = ({ videoRef, canvasRef, onAdDetected }) => {
 
         ws.onmessage = (event) => {
           try {
-            const detectedAds = JSON.parse(event.data);
-            onAdDetected(detectedAds);
+            // Binary messages are compact results (or heartbeats)
+            if (event.data instanceof ArrayBuffer) {
+              const ads = decodeCompactResult(event.data, adTable);
+              if (ads) onAdDetected(ads);
+              return;
+            }
+
+            const message = JSON.parse(event.data);
+            // Control messages (ping, stats, ad table) are objects, detections are arrays
+            if (!Array.isArray(message)) {
+              if (message.type === "ads") {
+                for (const ad of message.ads) {
+                  adTable[ad.index] = ad;
+                }
+              } else if (message.type === "control") {
+                frameInterval = 1000 / message.fps;
+                maxSide = message.maxSide;
+                jpegQuality = message.quality;
+                console.debug(
+                  `🎛 ${message.tier}: ${message.fps} fps, max side ${message.maxSide}, quality ${message.quality}`
+                );
+              } else if (message.type === "rejected") {
+                // Server at capacity: wait before reconnecting
+                console.warn(`⛔ ${message.reason}, retrying in ${message.retryAfter}s`);
+                retryDelay = message.retryAfter * 1000;
+              } else if (message.type === "stats") {
+                console.debug(
+                  `📊 processed ${message.processed}, dropped ${message.dropped}`
+                );
+              }
+              return;
+            }
+            onAdDetected(message);
           } catch (err) {
             console.error("❌ Failed to parse WS message:", err);
           }
         };
 
         ws.onclose = () => {
-          console.log("❌ WS closed, retrying in 2s...");
+          console.log(`❌ WS closed, retrying in ${retryDelay / 1000}s...`);
           isConnected = false;
           if (animationFrameId) {
             cancelAnimationFrame(animationFrameId);
           }
           // Auto-reconnect with backoff
-          reconnectTimeout = setTimeout(initWS, 2000);
+          reconnectTimeout = setTimeout(initWS, retryDelay);
+          retryDelay = 2000;
         };
 
         ws.onerror = (error) => {
@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from "react";
+import { fetchAllAds } from "../adsApi";
 
 const BACKEND_URL = "http://127.0.0.1:8000";
 
@@ -15,9 +16,7 @@ const AdminPanel = () => {
   // Fetch ads
   const fetchAds = async () => {
     try {
-      const res = await fetch(`${BACKEND_URL}/api/ads`);
-      const data = await res.json();
-      setAds(data);
+      setAds(await fetchAllAds());
     } catch (err) {
       console.error("Error fetching ads:", err);
     }
@@ -226,6 +225,11 @@ const AdminPanel = () => {
       />
       <h3 className="text-lg font-semibold mt-2">{ad.name}</h3>
       <p className="text-gray-600 mt-1">{ad.description}</p>
+      {ad.status && ad.status !== "ready" && (
+        <p className={`text-sm mt-1 ${ad.status === "failed" ? "text-red-600" : "text-orange-500"}`}>
+          {ad.status === "failed" ? `Marker processing failed: ${ad.error}` : "Processing marker..."}
+        </p>
+      )}
       <video 
         src={`${BACKEND_URL}${ad.videoUrl}`} 
         className="w-full mt-3 rounded-md" 
@@ -134,6 +134,7 @@ const FixedBoxVideoOverlay = ({ detectedAds, videoElements }) => {
           key={video.id}
           ref={(el) => (videoRefs.current[video.id] = el)}
           src={video.src}
+          poster={video.poster}
           loop={false}
           muted
           playsInline